@@ -0,0 +1,82 @@
+import time
+from typing import Callable, Optional
+
+MIB = 1024 * 1024
+
+# (minimum throughput/bitrate ratio, cache-secs, demuxer-max-bytes, demuxer-readahead-secs),
+# slowest link first. Slow links buffer deep to ride out dips, fast ones keep memory small.
+BUFFER_TIERS = (
+    (0, 600, 512 * MIB, 120),
+    (1.5, 120, 150 * MIB, 30),
+    (4, 30, 48 * MIB, 10),
+)
+DOWNGRADE_HEADROOM = 0.8  # Share of the measured throughput a lower-bitrate variant may use
+
+
+class BufferController:
+    """Sizes mpv's cache from the measured link throughput and the stream's bitrate
+
+    Fed with demuxer-cache-state samples. Throughput is an exponential moving
+    average of raw-input-rate, taken only while the demuxer is reading, since
+    an idle reader with a full cache says nothing about the link. A tier is
+    applied once it held for settle seconds; throughput below the bitrate for
+    downgrade_after seconds asks for a lower-bitrate variant, once per item.
+    """
+
+    def __init__(self, apply: Callable[[float, int, float], None], downgrade: Callable[[int], None],
+                 smoothing: float = 0.2, settle: float = 10, downgrade_after: float = 20):
+        self.apply = apply  # apply(cache_secs, max_bytes, readahead_secs)
+        self.downgrade = downgrade  # downgrade(max_bitrate in bits per second)
+        self.smoothing = smoothing
+        self.settle = settle
+        self.downgrade_after = downgrade_after
+        self.throughput: Optional[float] = None  # Bytes per second
+        self.tier: Optional[int] = None
+        self.media_id = None
+        self._candidate: Optional[int] = None
+        self._candidate_since = 0.0
+        self._slow_since: Optional[float] = None
+        self._downgraded = False
+
+    def update(self, media_id, cache_state: Optional[dict], bitrate: Optional[float],
+               now: Optional[float] = None) -> None:
+        """Take a demuxer-cache-state sample, bitrate is the stream's average in bytes per second"""
+        now = time.monotonic() if now is None else now
+        if media_id != self.media_id:
+            # New item, its link and bitrate may differ, the current tier stays until re-measured
+            self.media_id = media_id
+            self.throughput = None
+            self._candidate = self._slow_since = None
+            self._downgraded = False
+
+        if not cache_state or cache_state.get('idle'):
+            return
+        rate = cache_state.get('raw-input-rate')
+        if rate is None:
+            return
+        if self.throughput is None:
+            self.throughput = float(rate)
+        else:
+            self.throughput += self.smoothing * (rate - self.throughput)
+        if not bitrate:
+            return
+
+        ratio = self.throughput / bitrate
+        self._select_tier(max(i for i, tier in enumerate(BUFFER_TIERS) if ratio >= tier[0]), now)
+
+        if ratio >= 1:
+            self._slow_since = None
+        elif self._slow_since is None:
+            self._slow_since = now
+        elif now - self._slow_since >= self.downgrade_after and not self._downgraded:
+            self._downgraded = True
+            self.downgrade(int(self.throughput * 8 * DOWNGRADE_HEADROOM))
+
+    def _select_tier(self, tier: int, now: float) -> None:
+        if tier == self.tier:
+            self._candidate = None
+        elif tier != self._candidate:
+            self._candidate, self._candidate_since = tier, now
+        elif now - self._candidate_since >= self.settle:
+            self.tier, self._candidate = tier, None
+            self.apply(*BUFFER_TIERS[tier][1:])
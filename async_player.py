@@ -0,0 +1,142 @@
+import asyncio
+import functools
+from typing import Callable, List, Optional, Tuple
+
+import mpv
+from video_player import VideoPlayer
+
+
+class AsyncPlayer:
+    """asyncio facade over a VideoPlayer, bound to one event loop
+
+    mpv events are handed to the loop with call_soon_threadsafe and resolve
+    futures there, properties are read from the sampled slots. Commands go
+    out through command_async, so controlling the player never blocks the
+    loop, and no thread exists besides mpv's own event thread. Register a
+    wait before causing the event it waits for:
+
+        loaded = player.wait_for('file-loaded')
+        await player.play(url)
+        await loaded
+    """
+
+    def __init__(self, video: VideoPlayer, loop: asyncio.AbstractEventLoop):
+        self.video = video
+        self.loop = loop
+        self._event_waiters: List[Tuple[str, Callable[[dict], bool], asyncio.Future]] = []
+        video.set_event_listener(self._on_event)
+
+    @classmethod
+    async def create(cls, **mpv_options) -> 'AsyncPlayer':
+        """Start a player, bringing the core up off the loop since that blocks"""
+        loop = asyncio.get_running_loop()
+        video = await loop.run_in_executor(None, functools.partial(VideoPlayer, **mpv_options))
+        return cls(video, loop)
+
+    # State is read from the sampled property slots and never touches the core
+
+    @property
+    def media_id(self) -> Optional[int]:
+        return self.video.media_id
+
+    @property
+    def properties(self):
+        return self.video.properties
+
+    @property
+    def upcoming(self):
+        return self.video.upcoming
+
+    @property
+    def last_position(self) -> float:
+        return self.video.last_position
+
+    @property
+    def bitrate(self) -> Optional[float]:
+        return self.video.bitrate
+
+    def status(self) -> dict:
+        return self.video.status()
+
+    def wait_for(self, event: str, cond: Optional[Callable[[dict], bool]] = None) -> asyncio.Future:
+        """Future for the next mpv event of that name, resolved with the event as a dict
+
+        Only VideoPlayer's FORWARDED_EVENTS arrive. Fails with ShutdownError when the core goes away.
+        """
+        future = self.loop.create_future()
+        self._event_waiters.append((event, cond or (lambda _: True), future))
+        return future
+
+    def _on_event(self, event: dict) -> None:
+        """Called on mpv's event thread"""
+        if self._event_waiters:
+            self.loop.call_soon_threadsafe(self._resolve_event, event)
+
+    def _resolve_event(self, event: dict) -> None:
+        name = event.get('event')
+        remaining = []
+        for waiter in self._event_waiters:
+            wanted, cond, future = waiter
+            if future.done():
+                continue
+            if name == 'shutdown' and wanted != 'shutdown':
+                future.set_exception(mpv.ShutdownError("mpv core was shut down"))
+            elif name == wanted and cond(event):
+                future.set_result(event)
+            else:
+                remaining.append(waiter)
+        self._event_waiters = remaining
+
+    async def command(self, name: str, *args):
+        """Send an mpv command without blocking the loop and return its result"""
+        return await asyncio.wrap_future(self.video.player.command_async(name, *args), loop=self.loop)
+
+    async def play(self, path: str, media_id: int = None, mode: str = 'replace', start: float = None):
+        """Load a file like VideoPlayer.play_video, returns once mpv accepted the command"""
+        if self.video.player.core_shutdown:
+            await self.loop.run_in_executor(None, self.video.restart_core)
+            mode = 'replace'
+        await self.command(*self.video.load_command(path, media_id, mode, start))
+
+    async def reload(self, path: str, start: float = None):
+        """Reopen the current item from another source, keeping the queue"""
+        for command in self.video.reload_commands(path, start):
+            await self.command(*command)
+
+    async def stop(self):
+        """Stop playback but keep the core warm for the next item"""
+        self.video.clear_queue()
+        if not self.video.player.core_shutdown:
+            await self.command('stop')
+
+    async def next(self):
+        """Skip to the next queued item"""
+        if self.video.upcoming:
+            await self.command('playlist-next', 'weak')
+
+    async def seek(self, seconds: float, reference: str = 'absolute'):
+        """Seek to a position, or by an offset with reference='relative'"""
+        await self.command('seek', seconds, reference)
+
+    async def set_pause(self, paused: bool = None):
+        """Pause or resume playback, toggling when paused is None"""
+        if paused is None:
+            await self.command('cycle', 'pause')
+        else:
+            await self.command('set', 'pause', 'yes' if paused else 'no')
+
+    async def set_cache_limits(self, cache_secs: float, max_bytes: int, readahead_secs: float):
+        """Resize the demuxer cache of the running core"""
+        await asyncio.gather(
+            self.command('set', 'cache-secs', cache_secs),
+            self.command('set', 'demuxer-max-bytes', max_bytes),
+            self.command('set', 'demuxer-readahead-secs', readahead_secs),
+        )
+
+    async def close(self):
+        """Shut the core down for good, terminating it off the loop since that joins mpv's thread"""
+        for _, _, future in self._event_waiters:
+            future.cancel()
+        self._event_waiters = []
+        self.video.set_event_listener(None)
+        await self.loop.run_in_executor(None, self.video.close)
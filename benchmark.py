@@ -0,0 +1,451 @@
+"""Benchmarks for NostromoShim
+
+Run ``python benchmark.py`` for all benchmarks or pass their names to pick
+some. Timings are printed in milliseconds. With ``--json results.json``
+(or ``--json -`` for stdout) the results are also written as JSON, tagged
+with the commit they were measured on, for comparing runs across commits.
+API benchmarks run against the in-process stand-in server.
+"""
+import argparse
+import asyncio
+import contextlib
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+# Synthetic source so the player benchmarks need neither a server nor a file
+TEST_SOURCE = "av://lavfi:testsrc=duration=600:size=320x240:rate=25"
+HEADLESS = dict(vo='null', ao='null', force_window='no')
+
+# The launcher runs on every nostromoshim:// click and must stay this cheap
+LAUNCHER_IMPORT_BUDGET_MS = 30
+LAUNCHER_FORBIDDEN_MODULES = (
+    'asyncio', 'aiohttp', 'mpv', 'pystray', 'PIL', 'keyring', 'ctypes', 'tray_application'
+)
+REPO_DIR = os.path.dirname(os.path.abspath(__file__))
+
+
+def _summary(samples):
+    return {
+        "min_ms": min(samples) * 1000,
+        "median_ms": statistics.median(samples) * 1000,
+        "max_ms": max(samples) * 1000,
+    }
+
+
+def _timed_until_restart(player, action, timeout=10):
+    """Run action and return the seconds until mpv reports playback started"""
+    started = threading.Event()
+    handler = player.player.event_callback('playback-restart')(lambda event: started.set())
+    try:
+        start = time.perf_counter()
+        action()
+        if not started.wait(timeout):
+            raise TimeoutError("Playback did not start")
+        return time.perf_counter() - start
+    finally:
+        handler.unregister_mpv_events()
+
+
+def bench_player_switch(iterations=20):
+    """Item switch latency of a rebuilt player versus the warm player and its asyncio facade"""
+    from async_player import AsyncPlayer
+    from video_player import VideoPlayer
+
+    cold, teardown = [], []
+    for _ in range(iterations):
+        start = time.perf_counter()
+        player = VideoPlayer(**HEADLESS)
+        elapsed = time.perf_counter() - start
+        cold.append(elapsed + _timed_until_restart(
+            player, lambda: player.play_video(TEST_SOURCE)
+        ))
+        start = time.perf_counter()
+        player.close()
+        teardown.append(time.perf_counter() - start)
+
+    player = VideoPlayer(**HEADLESS)
+    warm, stop = [], []
+    try:
+        for _ in range(iterations):
+            warm.append(_timed_until_restart(
+                player, lambda: player.play_video(TEST_SOURCE)
+            ))
+            start = time.perf_counter()
+            player.stop()
+            stop.append(time.perf_counter() - start)
+    finally:
+        player.close()
+
+    async def async_switches():
+        player = await AsyncPlayer.create(**HEADLESS)
+        switch, stop = [], []
+        try:
+            for _ in range(iterations):
+                started = player.wait_for('playback-restart')
+                start = time.perf_counter()
+                await player.play(TEST_SOURCE)
+                await asyncio.wait_for(started, 10)
+                switch.append(time.perf_counter() - start)
+                start = time.perf_counter()
+                await player.stop()
+                stop.append(time.perf_counter() - start)
+        finally:
+            await player.close()
+        return switch, stop
+
+    async_switch, async_stop = asyncio.run(async_switches())
+    return {
+        "cold_switch": _summary(cold),
+        "cold_teardown": _summary(teardown),
+        "warm_switch": _summary(warm),
+        "warm_stop": _summary(stop),
+        "async_switch": _summary(async_switch),
+        "async_stop": _summary(async_stop),
+    }
+
+
+def use_memory_keyring():
+    """Keep tokens of clients pointed at a stand-in server out of the OS keyring"""
+    import keyring
+    import keyring.backend
+    import keyring.errors
+
+    class MemoryKeyring(keyring.backend.KeyringBackend):
+        priority = 1
+
+        def __init__(self):
+            super().__init__()
+            self._passwords = {}
+
+        def get_password(self, service, username):
+            return self._passwords.get((service, username))
+
+        def set_password(self, service, username, password):
+            self._passwords[(service, username)] = password
+
+        def delete_password(self, service, username):
+            if self._passwords.pop((service, username), None) is None:
+                raise keyring.errors.PasswordDeleteError(username)
+
+    if type(keyring.get_keyring()).__name__ != 'MemoryKeyring':
+        keyring.set_keyring(MemoryKeyring())
+
+
+def _start_loop_thread():
+    loop = asyncio.new_event_loop()
+    threading.Thread(target=loop.run_forever, daemon=True).start()
+    return loop
+
+
+def _start_stand_in(**options):
+    """Start a stand-in server on its own loop thread, so it doesn't share the client's loop"""
+    from stand_in_server import StandInServer
+
+    # Its port changes every run, real keyring entries would pile up and writes could prompt
+    use_memory_keyring()
+    loop = _start_loop_thread()
+    server = StandInServer(**options)
+    asyncio.run_coroutine_threadsafe(server.start(), loop).result()
+    return server, loop
+
+
+def _stop_stand_in(server, loop):
+    asyncio.run_coroutine_threadsafe(server.stop(), loop).result()
+    loop.call_soon_threadsafe(loop.stop)
+
+
+async def _logged_in_client(server):
+    from media_api_client import MediaAPIClient
+
+    client = MediaAPIClient(server.base_url)
+    await client.initialize()
+    if not await client.login("bench", "bench"):
+        raise RuntimeError("Login against the stand-in server failed")
+    return client
+
+
+def bench_login_latency(iterations=50):
+    """Login round-trip including storing the token"""
+    server, loop = _start_stand_in()
+
+    async def run():
+        client = await _logged_in_client(server)
+        samples = []
+        try:
+            for _ in range(iterations):
+                start = time.perf_counter()
+                await client.login("bench", "bench")
+                samples.append(time.perf_counter() - start)
+        finally:
+            await client.close()
+        return samples
+
+    try:
+        return {"login": _summary(asyncio.run(run()))}
+    finally:
+        _stop_stand_in(server, loop)
+
+
+def bench_report_throughput(iterations=20):
+    """Reporting positions for a backlog of items, batched versus one request each"""
+    from playback_reporter import REPLAY_BATCH_SIZE
+
+    server, loop = _start_stand_in()
+    positions = {media_id: media_id * 1.5 for media_id in range(REPLAY_BATCH_SIZE)}
+
+    async def run():
+        client = await _logged_in_client(server)
+        batched, single = [], []
+        try:
+            for batch_reporting, samples in ((None, batched), (False, single)):
+                for _ in range(iterations):
+                    client.batch_reporting = batch_reporting
+                    start = time.perf_counter()
+                    if not await client.report_playback_times(positions):
+                        raise RuntimeError("Reporting to the stand-in server failed")
+                    samples.append(time.perf_counter() - start)
+        finally:
+            await client.close()
+        return batched, single
+
+    try:
+        batched, single = asyncio.run(run())
+    finally:
+        _stop_stand_in(server, loop)
+    return {
+        f"batch_x{len(positions)}": _summary(batched),
+        f"single_x{len(positions)}": _summary(single),
+        "batch_reports_per_s": {"median": len(positions) / statistics.median(batched)},
+        "single_reports_per_s": {"median": len(positions) / statistics.median(single)},
+    }
+
+
+def bench_preflight_cost(iterations=100):
+    """Stream pre-flight against the server and answered from the pre-flight cache"""
+    server, loop = _start_stand_in()
+
+    async def run():
+        client = await _logged_in_client(server)
+        url = client.stream_url(1)
+        uncached, cached = [], []
+        try:
+            for use_cache, samples in ((False, uncached), (True, cached)):
+                for _ in range(iterations):
+                    start = time.perf_counter()
+                    if await client.probe_stream(url, use_cache=use_cache) != 200:
+                        raise RuntimeError("Pre-flight against the stand-in server failed")
+                    samples.append(time.perf_counter() - start)
+        finally:
+            await client.close()
+        return uncached, cached
+
+    try:
+        uncached, cached = asyncio.run(run())
+    finally:
+        _stop_stand_in(server, loop)
+    return {"probe": _summary(uncached), "probe_cached": _summary(cached)}
+
+
+def bench_bulk_fetch(iterations=5, records=200, latency=0.005):
+    """Fetching many media records sequentially versus with bounded fan-out, and paging a library"""
+    server, loop = _start_stand_in(latency=latency, library_size=records * 10)
+    endpoints = [f"/api/media/{media_id}" for media_id in range(1, records + 1)]
+
+    async def run():
+        client = await _logged_in_client(server)
+        sequential, fan_out, paged = [], [], []
+        try:
+            for _ in range(iterations):
+                start = time.perf_counter()
+                for endpoint in endpoints:
+                    await client.get_authenticated(endpoint, use_cache=False)
+                sequential.append(time.perf_counter() - start)
+
+                start = time.perf_counter()
+                await client.get_many(endpoints)
+                fan_out.append(time.perf_counter() - start)
+
+                start = time.perf_counter()
+                async for _ in client.iter_pages("/api/media"):
+                    pass
+                paged.append(time.perf_counter() - start)
+        finally:
+            await client.close()
+        return sequential, fan_out, paged
+
+    try:
+        sequential, fan_out, paged = asyncio.run(run())
+    finally:
+        _stop_stand_in(server, loop)
+    return {
+        f"sequential_x{records}": _summary(sequential),
+        f"get_many_x{records}": _summary(fan_out),
+        f"iter_pages_x{records * 10}": _summary(paged),
+    }
+
+
+def bench_ipc_handoff(iterations=200):
+    """Launcher to running instance handoff over the framed IPC protocol"""
+    from ipc_protocol import HAS_UNIX_SOCKETS, IPCClient, serve_connection
+
+    async def dispatch(cmd, args):
+        return {'accepted': True}
+
+    async def handle(reader, writer):
+        await serve_connection(reader, writer, dispatch)
+
+    socket_path = os.path.join(tempfile.mkdtemp(), 'bench.sock')
+
+    async def start():
+        servers = [await asyncio.start_server(handle, 'localhost', 0)]
+        if HAS_UNIX_SOCKETS:
+            servers.append(await asyncio.start_unix_server(handle, socket_path))
+        return servers
+
+    loop = _start_loop_thread()
+    servers = asyncio.run_coroutine_threadsafe(start(), loop).result()
+    port = servers[0].sockets[0].getsockname()[1]
+    url = "http://localhost:8112/api/media/stream/1"
+
+    def handoff(socket_path):
+        start = time.perf_counter()
+        with IPCClient(port=port, socket_path=socket_path) as client:
+            client.request('play', url=url)
+        return time.perf_counter() - start
+
+    results = {"tcp_handoff": _summary([handoff(None) for _ in range(iterations)])}
+    if HAS_UNIX_SOCKETS:
+        results["unix_handoff"] = _summary([handoff(socket_path) for _ in range(iterations)])
+
+    pipelined = []
+    with IPCClient(port=port, socket_path=None) as client:
+        for _ in range(iterations):
+            start = time.perf_counter()
+            client.pipeline([('play', {'url': url}), ('status', {}), ('pause', {})])
+            pipelined.append(time.perf_counter() - start)
+    results["pipelined_x3"] = _summary(pipelined)
+
+    async def stop():
+        for server in servers:
+            server.close()
+            await server.wait_closed()
+        await asyncio.sleep(0.1)  # Let the last connection handler see EOF
+
+    asyncio.run_coroutine_threadsafe(stop(), loop).result()
+    loop.call_soon_threadsafe(loop.stop)
+    return results
+
+
+def _import_time_ms(module):
+    """Cumulative import time of a module in a fresh interpreter, from -X importtime"""
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        cwd=REPO_DIR, capture_output=True, text=True, check=True
+    )
+    for line in result.stderr.splitlines():
+        fields = [field.strip() for field in line.split(":", 1)[-1].split("|")]
+        if len(fields) == 3 and fields[2] == module:
+            return int(fields[1]) / 1000
+    raise RuntimeError(f"No import time reported for {module}")
+
+
+def bench_launcher_startup(iterations=10):
+    """Import cost and process startup of the nostromoshim:// launcher, guarded by a budget"""
+    check = subprocess.run(
+        [sys.executable, "-c", "import sys, tray_app; print(' '.join(sys.modules))"],
+        cwd=REPO_DIR, capture_output=True, text=True, check=True
+    )
+    loaded = set(check.stdout.split())
+    leaked = [name for name in LAUNCHER_FORBIDDEN_MODULES if name in loaded]
+    if leaked:
+        raise AssertionError(f"Launcher imports heavy modules: {', '.join(leaked)}")
+
+    imports = [_import_time_ms("tray_app") / 1000 for _ in range(iterations)]
+    baseline, launcher = [], []
+    for command in ("pass", "import tray_app"):
+        samples = baseline if command == "pass" else launcher
+        for _ in range(iterations):
+            start = time.perf_counter()
+            subprocess.run([sys.executable, "-c", command], cwd=REPO_DIR, check=True)
+            samples.append(time.perf_counter() - start)
+
+    median_ms = statistics.median(imports) * 1000
+    if median_ms > LAUNCHER_IMPORT_BUDGET_MS:
+        raise AssertionError(
+            f"Launcher import takes {median_ms:.1f}ms, budget is {LAUNCHER_IMPORT_BUDGET_MS}ms"
+        )
+    return {
+        "import_tray_app": _summary(imports),
+        "bare_interpreter": _summary(baseline),
+        "launcher_process": _summary(launcher),
+    }
+
+
+BENCHMARKS = {
+    "login_latency": bench_login_latency,
+    "report_throughput": bench_report_throughput,
+    "preflight_cost": bench_preflight_cost,
+    "bulk_fetch": bench_bulk_fetch,
+    "player_switch": bench_player_switch,
+    "ipc_handoff": bench_ipc_handoff,
+    "launcher_startup": bench_launcher_startup,
+}
+
+
+def _commit():
+    result = subprocess.run(
+        ["git", "rev-parse", "HEAD"], cwd=REPO_DIR, capture_output=True, text=True
+    )
+    return result.stdout.strip() or None
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("names", nargs="*", help=f"any of: {', '.join(BENCHMARKS)}")
+    parser.add_argument("-n", "--iterations", type=int, help="repetitions per benchmark")
+    parser.add_argument("--json", metavar="PATH", help="also write the results as JSON, - for stdout")
+    args = parser.parse_args()
+    unknown = set(args.names) - set(BENCHMARKS)
+    if unknown:
+        parser.error(f"unknown benchmark(s): {', '.join(sorted(unknown))}")
+
+    # Keep stdout clean for the JSON document when it goes there
+    report = sys.stderr if args.json == "-" else sys.stdout
+    results = {}
+    with contextlib.redirect_stdout(report):
+        for name in args.names or BENCHMARKS:
+            if args.iterations:
+                results[name] = BENCHMARKS[name](args.iterations)
+            else:
+                results[name] = BENCHMARKS[name]()
+            print(name)
+            for metric, summary in results[name].items():
+                print(f"  {metric:<20} " + "  ".join(
+                    f"{key} {value:10.2f}" for key, value in summary.items()
+                ))
+
+    if args.json:
+        document = json.dumps({
+            "commit": _commit(),
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "iterations": args.iterations,
+            "results": results,
+        }, indent=2)
+        if args.json == "-":
+            print(document)
+        else:
+            with open(args.json, "w") as f:
+                f.write(document + "\n")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,181 @@
+"""Length-prefixed message protocol between NostromoShim instances
+
+Every message is a 4-byte big-endian length followed by that many bytes of
+UTF-8 JSON. Requests look like ``{"id": 1, "cmd": "play", "args": {...}}``
+and each gets a reply ``{"id": 1, "ok": true, "result": ...}`` or
+``{"id": 1, "ok": false, "error": "..."}`` in request order, so a client
+may pipeline several commands on one connection.
+
+Only settings and stdlib modules that are cheap to import are used here, since the
+launcher forwarding a URL to the running instance imports this module.
+"""
+import json
+import os
+import re
+import socket
+import struct
+import tempfile
+from typing import Optional
+
+from settings import PROTOCOL_HANDLER
+
+IPC_HOST = 'localhost'
+IPC_PORT = 45678
+IPC_SOCKET_PATH = os.path.join(
+    tempfile.gettempdir(), f"nostromoshim-{os.environ.get('USER') or os.environ.get('USERNAME', '')}.sock"
+)
+HAS_UNIX_SOCKETS = hasattr(socket, 'AF_UNIX')
+MAX_FRAME_SIZE = 1024 * 1024
+
+_HEADER = struct.Struct('>I')
+# Launchers before the framed protocol sent a bare URL and closed
+_LEGACY_PREFIXES = (b'http', b'nost')
+
+
+class IPCError(Exception):
+    """Raised when the other instance can't be reached or rejects a command"""
+
+
+def media_id_from_protocol_url(url: str) -> Optional[int]:
+    """Media id of a nostromoshim://play/<id> URL, None for anything else"""
+    match = re.match(rf'{PROTOCOL_HANDLER}://play/(\d+)', url)
+    return int(match.group(1)) if match else None
+
+
+def encode_frame(message: dict) -> bytes:
+    body = json.dumps(message, separators=(',', ':')).encode('utf-8')
+    if len(body) > MAX_FRAME_SIZE:
+        raise IPCError(f"Message of {len(body)} bytes exceeds the frame limit")
+    return _HEADER.pack(len(body)) + body
+
+
+async def serve_connection(reader, writer, dispatch) -> None:
+    """Answer framed requests on an asyncio stream until the client disconnects
+
+    dispatch(cmd, args) is awaited for every request and its return value
+    becomes the reply's result; exceptions turn into error replies.
+    """
+    try:
+        while True:
+            try:
+                header = await reader.readexactly(_HEADER.size)
+            except EOFError:  # asyncio.IncompleteReadError
+                return
+
+            if header.startswith(_LEGACY_PREFIXES):
+                url = (header + await reader.read(MAX_FRAME_SIZE)).decode('utf-8', 'replace').strip()
+                if url.startswith('http'):
+                    await dispatch('play', {'url': url})
+                else:
+                    # A protocol URL only names the media, the tray resolves it against its servers
+                    media_id = media_id_from_protocol_url(url)
+                    if media_id is not None:
+                        await dispatch('play', {'media_id': media_id})
+                return
+
+            (length,) = _HEADER.unpack(header)
+            if length > MAX_FRAME_SIZE:
+                # The body can't be skipped safely, reply before dropping the connection
+                writer.write(encode_frame({'id': None, 'ok': False, 'error': 'Message too large'}))
+                await writer.drain()
+                return
+            try:
+                request = json.loads(await reader.readexactly(length))
+            except EOFError:
+                return
+            except ValueError:
+                request = None
+            if not isinstance(request, dict):
+                writer.write(encode_frame({'id': None, 'ok': False, 'error': 'Malformed message'}))
+                continue
+
+            reply = {'id': request.get('id')}
+            try:
+                reply['result'] = await dispatch(request.get('cmd'), request.get('args') or {})
+                reply['ok'] = True
+            except Exception as e:
+                reply['ok'] = False
+                reply['error'] = str(e) or type(e).__name__
+            writer.write(encode_frame(reply))
+            await writer.drain()
+    finally:
+        writer.close()
+
+
+class IPCClient:
+    """Blocking client for the running instance, preferring the Unix socket where available"""
+
+    def __init__(self, timeout: float = 1.0, port: int = IPC_PORT,
+                 socket_path: Optional[str] = IPC_SOCKET_PATH):
+        self.timeout = timeout
+        self.port = port
+        self.socket_path = socket_path if HAS_UNIX_SOCKETS else None
+        self._sock = None
+        self._next_id = 0
+
+    def connect(self) -> 'IPCClient':
+        if self.socket_path and os.path.exists(self.socket_path):
+            sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            sock.settimeout(self.timeout)
+            try:
+                sock.connect(self.socket_path)
+                self._sock = sock
+                return self
+            except OSError:
+                sock.close()
+        try:
+            self._sock = socket.create_connection((IPC_HOST, self.port), timeout=self.timeout)
+        except OSError as e:
+            raise IPCError(f"No running instance: {e}")
+        self._sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        return self
+
+    def close(self) -> None:
+        if self._sock:
+            self._sock.close()
+            self._sock = None
+
+    def __enter__(self) -> 'IPCClient':
+        return self.connect() if self._sock is None else self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
+
+    def request(self, cmd: str, **args):
+        """Send one command and return its result"""
+        return self.pipeline([(cmd, args)])[0]
+
+    def pipeline(self, commands):
+        """Send (cmd, args) pairs in one write, then return their results in order"""
+        if self._sock is None:
+            self.connect()
+        frames = []
+        for cmd, args in commands:
+            self._next_id += 1
+            frames.append(encode_frame({'id': self._next_id, 'cmd': cmd, 'args': args}))
+        try:
+            self._sock.sendall(b''.join(frames))
+            replies = [self._read_frame() for _ in frames]
+        except OSError as e:
+            self.close()
+            raise IPCError(f"Connection to running instance failed: {e}")
+
+        results = []
+        for reply in replies:
+            if not reply.get('ok'):
+                raise IPCError(reply.get('error', 'Command failed'))
+            results.append(reply.get('result'))
+        return results
+
+    def _read_frame(self) -> dict:
+        (length,) = _HEADER.unpack(self._recv_exactly(_HEADER.size))
+        return json.loads(self._recv_exactly(length))
+
+    def _recv_exactly(self, size: int) -> bytes:
+        data = bytearray()
+        while len(data) < size:
+            chunk = self._sock.recv(size - len(data))
+            if not chunk:
+                raise ConnectionResetError("Connection closed by running instance")
+            data += chunk
+        return bytes(data)
@@ -0,0 +1,208 @@
+import asyncio
+import os
+import sqlite3
+import threading
+import time
+from datetime import datetime
+from urllib.parse import quote
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from media_api_client import PAGE_SIZE
+
+FINISHED_SHARE = 0.95  # Items watched past this share of their duration count as finished
+FINISHED_REMAINING = 10  # So do items with at most this many seconds left
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS media (
+    id INTEGER PRIMARY KEY,
+    title TEXT,
+    duration REAL,
+    updated_at TEXT
+);
+CREATE TABLE IF NOT EXISTS positions (
+    media_id INTEGER PRIMARY KEY,
+    position REAL NOT NULL,
+    watched_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS positions_watched_at ON positions (watched_at);
+CREATE TABLE IF NOT EXISTS sync_state (
+    key TEXT PRIMARY KEY,
+    value TEXT
+);
+"""
+
+
+class LibraryIndex:
+    """Local SQLite copy of the library and of recent playback positions
+
+    Safe to use from several threads, writes are expected to come from an
+    executor and reads from the tray's menu thread.
+    """
+
+    def __init__(self, path: str):
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._lock = threading.Lock()
+        with self._lock, self._db:
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.executescript(_SCHEMA)
+
+    @property
+    def cursor(self) -> Optional[str]:
+        """Changed-since cursor of the last completed sync"""
+        with self._lock:
+            row = self._db.execute("SELECT value FROM sync_state WHERE key = 'cursor'").fetchone()
+        return row[0] if row else None
+
+    def apply_changes(self, records: Iterable[dict], cursor: Optional[str]) -> None:
+        """Upsert changed media records, with any position they carry, and advance the cursor"""
+        media, positions = [], []
+        for record in records:
+            media.append((record['id'], record.get('title'), record.get('duration'),
+                          _text(record.get('updatedAt'))))
+            if record.get('position'):
+                positions.append((record['id'], record['position'], _timestamp(record.get('lastWatched'))))
+
+        with self._lock, self._db:
+            self._db.executemany(
+                "INSERT INTO media (id, title, duration, updated_at) VALUES (?, ?, ?, ?) "
+                "ON CONFLICT (id) DO UPDATE SET title = excluded.title, "
+                "duration = excluded.duration, updated_at = excluded.updated_at",
+                media
+            )
+            # A position watched here more recently than the server knows about wins
+            self._db.executemany(
+                "INSERT INTO positions (media_id, position, watched_at) VALUES (?, ?, ?) "
+                "ON CONFLICT (media_id) DO UPDATE SET position = excluded.position, "
+                "watched_at = excluded.watched_at WHERE excluded.watched_at > positions.watched_at",
+                positions
+            )
+            if cursor is not None:
+                self._db.execute(
+                    "INSERT OR REPLACE INTO sync_state (key, value) VALUES ('cursor', ?)", (cursor,)
+                )
+
+    def record_positions(self, positions: Dict[int, float], watched_at: Optional[float] = None) -> None:
+        """Store positions watched locally"""
+        watched_at = time.time() if watched_at is None else watched_at
+        with self._lock, self._db:
+            self._db.executemany(
+                "INSERT OR REPLACE INTO positions (media_id, position, watched_at) VALUES (?, ?, ?)",
+                [(media_id, position, watched_at) for media_id, position in positions.items()]
+            )
+
+    def continue_watching(self, limit: int = 10) -> List[Tuple[int, str, float]]:
+        """(media_id, title, position) of started but unfinished items, last watched first"""
+        with self._lock:
+            return self._db.execute(
+                "SELECT p.media_id, COALESCE(m.title, 'Media ' || p.media_id), p.position "
+                "FROM positions p LEFT JOIN media m ON m.id = p.media_id "
+                "WHERE m.duration IS NULL OR p.position < MIN(m.duration * ?, m.duration - ?) "
+                "ORDER BY p.watched_at DESC LIMIT ?",
+                (FINISHED_SHARE, FINISHED_REMAINING, limit)
+            ).fetchall()
+
+    def duration(self, media_id: int) -> Optional[float]:
+        """Duration of a media item in seconds, None if unknown"""
+        with self._lock:
+            row = self._db.execute("SELECT duration FROM media WHERE id = ?", (media_id,)).fetchone()
+        return row[0] if row else None
+
+    def recent(self, limit: int = 10) -> List[Tuple[int, str, float]]:
+        """(media_id, title, position) of the last watched items, finished or not"""
+        with self._lock:
+            return self._db.execute(
+                "SELECT p.media_id, COALESCE(m.title, 'Media ' || p.media_id), p.position "
+                "FROM positions p LEFT JOIN media m ON m.id = p.media_id "
+                "ORDER BY p.watched_at DESC LIMIT ?",
+                (limit,)
+            ).fetchall()
+
+    def close(self) -> None:
+        with self._lock:
+            self._db.close()
+
+
+def is_finished(position: float, duration: Optional[float]) -> bool:
+    """Whether a position counts as watched to the end, never when the duration is unknown"""
+    return bool(duration) and position >= min(duration * FINISHED_SHARE, duration - FINISHED_REMAINING)
+
+
+def _text(value) -> Optional[str]:
+    return None if value is None else str(value)
+
+
+def _timestamp(value) -> float:
+    """Seconds since the epoch from a number or an ISO 8601 string, now if unknown"""
+    if isinstance(value, (int, float)):
+        return float(value)
+    if isinstance(value, str):
+        try:
+            return datetime.fromisoformat(value.replace('Z', '+00:00')).timestamp()
+        except ValueError:
+            pass
+    return time.time()
+
+
+class LibrarySync:
+    """Keeps a LibraryIndex up to date by delta sync from the server in the background
+
+    Each sync pages through /api/media?changedSince=<cursor> and moves the
+    cursor to the newest updatedAt seen, so only changed records travel.
+    on_change is called on the loop after a sync that changed anything.
+    """
+
+    def __init__(self, client, index: LibraryIndex, interval: float = 300, on_change=None):
+        self.client = client
+        self.index = index
+        self.interval = interval
+        self.on_change = on_change
+        self._task: Optional[asyncio.Task] = None
+
+    def start(self) -> None:
+        if self._task is None:
+            self._task = asyncio.ensure_future(self._run())
+
+    async def _run(self) -> None:
+        try:
+            while True:
+                try:
+                    await self.sync()
+                except Exception as e:
+                    print(f"Library sync failed: {e!r}")
+                await asyncio.sleep(self.interval)
+        except asyncio.CancelledError:
+            pass
+
+    async def sync(self) -> int:
+        """Fetch records changed since the last sync, returns how many changed"""
+        if not self.client.token:
+            return 0
+        loop = asyncio.get_running_loop()
+        cursor = await loop.run_in_executor(None, lambda: self.index.cursor)
+        # ISO 8601 cursors carry '+' and ':', which must not reach the server raw
+        endpoint = "/api/media" if cursor is None else f"/api/media?changedSince={quote(cursor, safe='')}"
+
+        changed, batch, newest = 0, [], None
+        async for record in self.client.iter_pages(endpoint):
+            batch.append(record)
+            updated = record.get('updatedAt')
+            if updated is not None and (newest is None or updated > newest):
+                newest = updated
+            if len(batch) == PAGE_SIZE:
+                await loop.run_in_executor(None, self.index.apply_changes, batch, None)
+                changed += len(batch)
+                batch = []
+        # The cursor only moves once every page is stored, an interrupted sync starts over
+        await loop.run_in_executor(None, self.index.apply_changes, batch, _text(newest) or cursor)
+        changed += len(batch)
+
+        if changed and self.on_change:
+            self.on_change()
+        return changed
+
+    async def stop(self) -> None:
+        if self._task:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
@@ -1,6 +1,5 @@
 from video_player import VideoPlayer
 from media_api_client import  MediaAPIClient
-import requests
 import asyncio
 
 video_id = 1
@@ -24,9 +23,10 @@ async def main():
             print("Login failed")
 
 
-    response = requests.get(stream_url, stream=True)
-    if response.status_code != 200:
-        print(f"Error: HTTP {response.status_code}")
+    status = await client.probe_stream(stream_url)
+    await client.close()
+    if status != 200:
+        print(f"Error: HTTP {status}")
         exit(1)
 
 
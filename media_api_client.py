@@ -1,26 +1,103 @@
 import keyring
 import requests
 from getpass import getpass
-from typing import Optional
+from collections import deque
+from typing import Any, AsyncIterator, Dict, Hashable, Iterable, List, Optional, Sequence, Tuple, Union
+from response_cache import CacheEntry, ResponseCache
+from metrics import Metrics, timed
+from server_pool import ServerPool
 import aiohttp
 import asyncio
+import json
+import re
+import time
+
+# Connection pool shared by everything in the process that talks to the media server
+POOL_LIMIT = 32  # Open connections in total
+POOL_LIMIT_PER_HOST = 8  # Open connections per server
+KEEPALIVE_TIMEOUT = 60  # Seconds an idle connection is kept for reuse
+DNS_CACHE_TTL = 300  # Seconds a resolved host is cached
+CONNECT_TIMEOUT = 5
+READ_TIMEOUT = 30
+BULK_CONCURRENCY = POOL_LIMIT_PER_HOST  # Requests in flight per fetch_many call
+PAGE_SIZE = 100  # Items per page when iterating listings
+
+
+def create_connector() -> aiohttp.TCPConnector:
+    """Create the tuned connection pool, must be called with a running loop"""
+    return aiohttp.TCPConnector(
+        limit=POOL_LIMIT,
+        limit_per_host=POOL_LIMIT_PER_HOST,
+        keepalive_timeout=KEEPALIVE_TIMEOUT,
+        ttl_dns_cache=DNS_CACHE_TTL
+    )
+
+
+def create_session(connector: Optional[aiohttp.BaseConnector] = None) -> aiohttp.ClientSession:
+    """Create a session on the tuned pool, or on a given connector which it then won't close"""
+    return aiohttp.ClientSession(
+        connector=connector or create_connector(),
+        connector_owner=connector is None,
+        timeout=aiohttp.ClientTimeout(sock_connect=CONNECT_TIMEOUT, sock_read=READ_TIMEOUT)
+    )
+
+
+# A stream on any host, or just its path, as launchers and older clients send it
+_STREAM_URL = re.compile(r'^(?:https?://[^/]+)?(/api/media/stream/\d+.*)$')
+
+
+def stream_path(media_id: int) -> str:
+    """Path of the stream for a media item, to be resolved against a server by MediaAPIClient.route"""
+    return f"/api/media/stream/{media_id}"
+
+
+class NotAuthenticatedError(aiohttp.ClientError):
+    """No token for the server in use and logging in again did not get one"""
+
 
 class MediaAPIClient:
-    def __init__(self, base_url: str = "http://localhost:8112"):
-        self.base_url = base_url
-        self.session: Optional[aiohttp.ClientSession] = None
+    def __init__(
+        self,
+        base_url: Union[str, Sequence[str]] = "http://localhost:8112",
+        session: Optional[aiohttp.ClientSession] = None,
+        connector: Optional[aiohttp.BaseConnector] = None,
+        response_cache: Optional[ResponseCache] = None,
+        metrics: Optional[Metrics] = None
+    ):
+        urls = [base_url] if isinstance(base_url, str) else list(base_url)
+        self.base_url = urls[0]  # Server in use, tokens are stored per server
+        self.servers = ServerPool(urls) if len(urls) > 1 else None  # Mirrors to route between
+        self._server_tokens: Dict[str, Tuple[Optional[str], Optional[str]]] = {}
+        self._switching = asyncio.Lock()
+        self.session: Optional[aiohttp.ClientSession] = session
+        self._connector = connector
+        self._owns_session = session is None
         self.token: Optional[str] = None
         self.current_profile: Optional[str] = None
         self.device = "NostromoShim"
+        self.batch_reporting: Optional[bool] = None  # Unknown until first batch attempt
+        self.preflight_ttl = 30  # Seconds a successful stream pre-flight stays valid
+        self._preflight_cache: Dict[str, Tuple[float, int]] = {}
+        self._credentials: Optional[Tuple[str, str]] = None  # Kept in memory for re-login
+        self._relogin: Optional[asyncio.Future] = None
+        self.response_cache = response_cache  # Opt-in cache for get_authenticated
+        self._inflight_gets: Dict[Hashable, asyncio.Future] = {}
+        self.metrics = metrics  # Per-call latency histograms when set
 
     async def initialize(self) -> None:
         """Initialize the client and load existing token"""
-        self.session = aiohttp.ClientSession()
+        if self.session is None:
+            self.session = create_session(self._connector)
+        if self.servers:
+            self.base_url = await self.servers.probe_all(self.session)
+            self.servers.start(self.session)
         await self._load_existing_token()
 
     async def close(self) -> None:
-        """Close the session"""
-        if self.session:
+        """Close the session unless it was injected"""
+        if self.servers:
+            await self.servers.stop()
+        if self.session and self._owns_session:
             await self.session.close()
 
     def _get_service_name(self) -> str:
@@ -29,18 +106,31 @@ class MediaAPIClient:
     async def _load_existing_token(self) -> None:
         """Load stored token from system keyring"""
         try:
-            self.current_profile = keyring.get_password(
-                self._get_service_name(), "current_profile"
+            # Keyring backends can block for a long time, keep them off the loop
+            self.current_profile, self.token = await asyncio.get_running_loop().run_in_executor(
+                None, self._read_keyring
             )
-            if self.current_profile:
-                self.token = keyring.get_password(
-                    self._get_service_name(), f"{self.current_profile}_token"
-                )
         except Exception as e:
             print(f"Error loading credentials: {e}")
             self.token = None
             self.current_profile = None
 
+    def _read_keyring(self) -> Tuple[Optional[str], Optional[str]]:
+        profile = keyring.get_password(self._get_service_name(), "current_profile")
+        token = None
+        if profile:
+            token = keyring.get_password(self._get_service_name(), f"{profile}_token")
+        return profile, token
+
+    def _write_keyring(self, username: str, token: str) -> None:
+        keyring.set_password(self._get_service_name(), f"{username}_token", token)
+        keyring.set_password(self._get_service_name(), "current_profile", username)
+
+    def set_credentials(self, username: str, password: str) -> None:
+        """Remember credentials in memory so an expired token can be renewed without prompting"""
+        self._credentials = (username, password)
+
+    @timed
     async def login(self, username: str, password: Optional[str] = None) -> bool:
         """Authenticate with the server and store token securely"""
         if not password:
@@ -61,23 +151,97 @@ class MediaAPIClient:
 
                 self.token = token
                 self.current_profile = username
-
-                # Store credentials securely
-                keyring.set_password(
-                    self._get_service_name(),
-                    f"{username}_token",
-                    self.token
-                )
-                keyring.set_password(
-                    self._get_service_name(),
-                    "current_profile",
-                    username
-                )
-                return True
+                self._credentials = (username, password)
         except aiohttp.ClientError as e:
             print(f"Login failed: {e}")
             return False
 
+        # Store credentials securely
+        try:
+            await asyncio.get_running_loop().run_in_executor(
+                None, self._write_keyring, username, token
+            )
+        except Exception as e:
+            print(f"Error storing credentials: {e}")
+        return True
+
+    async def _reauthenticate(self, rejected_token: Optional[str]) -> bool:
+        """Log in again after a 401, all concurrent callers share a single login"""
+        if self.token != rejected_token:
+            return True  # Someone else already renewed the token
+        if not self._credentials:
+            return False
+
+        if self._relogin is None:
+            print("No valid token, logging in again")
+            self._relogin = asyncio.ensure_future(self.login(*self._credentials))
+            self._relogin.add_done_callback(lambda _: setattr(self, '_relogin', None))
+        return await asyncio.shield(self._relogin)
+
+    async def _follow_preferred_server(self) -> None:
+        """Move to the server the pool prefers, with the token stored for that server"""
+        async with self._switching:
+            url = self.servers.preferred
+            if url == self.base_url:
+                return
+            print(f"Switching to server {url}")
+            self._server_tokens[self.base_url] = (self.current_profile, self.token)
+            self.base_url = url
+            if url in self._server_tokens:
+                self.current_profile, self.token = self._server_tokens[url]
+            else:
+                await self._load_existing_token()
+            if not self.token and self._credentials:
+                await self.login(*self._credentials)
+
+    async def _send_authenticated(self, method: str, endpoint: str, **kwargs) -> aiohttp.ClientResponse:
+        """Send an authenticated request, on the preferred server when there are several
+
+        A request failing on a server whose breaker it tripped is retried once on the next one.
+        """
+        if not self.servers:
+            return await self._send_to_current_server(method, endpoint, **kwargs)
+
+        for retry in (False, True):
+            if self.servers.preferred != self.base_url:
+                await self._follow_preferred_server()
+            url = self.base_url
+            try:
+                response = await self._send_to_current_server(method, endpoint, **kwargs)
+            except (aiohttp.ClientConnectionError, asyncio.TimeoutError):
+                self.servers.record_failure(url)
+                if retry or self.servers.preferred == url:
+                    raise
+                continue
+
+            if response.status < 500:
+                self.servers.record_success(url)
+                return response
+            self.servers.record_failure(url)
+            if retry or self.servers.preferred == url:
+                return response
+            response.release()
+
+    async def _send_to_current_server(self, method: str, endpoint: str, **kwargs) -> aiohttp.ClientResponse:
+        """Send an authenticated request, replaying it once after re-login on a 401"""
+        if not self.token:
+            # After a failed login on a mirror, try again now that the server may be back
+            await self._reauthenticate(None)
+            if not self.token:
+                raise NotAuthenticatedError("Not authenticated")
+
+        token = self.token
+        response = await self._request_with_token(method, endpoint, token, **kwargs)
+        if response.status == 401 and await self._reauthenticate(token):
+            response.release()
+            response = await self._request_with_token(method, endpoint, self.token, **kwargs)
+        return response
+
+    def _request_with_token(self, method: str, endpoint: str, token: str, **kwargs):
+        headers = dict(kwargs.pop("headers", None) or {})
+        headers["Authorization"] = f"Bearer {token}"
+        return self.session.request(method, f"{self.base_url}{endpoint}", headers=headers, **kwargs)
+
     def logout(self) -> None:
         """Clear local credentials and session"""
         if self.current_profile:
@@ -94,26 +258,145 @@ class MediaAPIClient:
             except Exception as e:
                 print(f"Error clearing credentials: {e}")
         
-        self.session.close()
+        if self._owns_session:
+            self.session.close()
         self.token = None
         self.current_profile = None
 
-    async def get_authenticated(self, endpoint: str) -> Optional[dict]:
-        """Make authenticated GET request"""
-        if not self.token:
-            raise ValueError("Not authenticated")
+    @timed
+    async def get_authenticated(self, endpoint: str, use_cache: bool = True) -> Optional[dict]:
+        """Make authenticated GET request, answered from the response cache when one is set"""
+        if not self.response_cache or not use_cache:
+            return await self._get_json(endpoint)
+
+        key = (self.current_profile, endpoint)
+        entry = self.response_cache.get(key)
+        if entry and entry.fresh:
+            self.response_cache.hits += 1
+            return entry.data
 
+        # Identical concurrent GETs share one request
+        request = self._inflight_gets.get(key)
+        if request is None:
+            request = asyncio.ensure_future(self._get_cached(key, endpoint, entry))
+            self._inflight_gets[key] = request
+            request.add_done_callback(lambda _: self._inflight_gets.pop(key, None))
+        return await asyncio.shield(request)
+
+    async def _get_cached(self, key: Hashable, endpoint: str, entry: Optional[CacheEntry]) -> Optional[dict]:
+        """Fetch an endpoint into the cache, revalidating a stale entry if there is one"""
         try:
-            async with self.session.get(
-                f"{self.base_url}{endpoint}",
-                headers={"Authorization": f"Bearer {self.token}"}
+            async with await self._send_authenticated(
+                "GET", endpoint, headers=entry.validators if entry else None
             ) as response:
+                if response.status == 304 and entry:
+                    self.response_cache.revalidations += 1
+                    self.response_cache.refresh(entry)
+                    return entry.data
+
+                response.raise_for_status()
+                body = await response.read()
+                data = json.loads(body)
+                self.response_cache.misses += 1
+                self.response_cache.put(
+                    key, data, len(body),
+                    response.headers.get("ETag"), response.headers.get("Last-Modified")
+                )
+                return data
+        except aiohttp.ClientError as e:
+            print(f"Request failed: {e}")
+            return None
+
+    async def _get_json(self, endpoint: str) -> Optional[dict]:
+        try:
+            async with await self._send_authenticated("GET", endpoint) as response:
                 response.raise_for_status()
                 return await response.json()
         except aiohttp.ClientError as e:
             print(f"Request failed: {e}")
             return None
 
+    async def fetch_many(
+        self, endpoints: Iterable[str], concurrency: int = BULK_CONCURRENCY, ordered: bool = True
+    ) -> AsyncIterator[Tuple[str, Optional[dict]]]:
+        """GET many endpoints concurrently, yielding (endpoint, data) in input order or as completed
+
+        At most concurrency requests are in flight, so endpoints may be a lazy
+        iterable of any length. A failed request yields None for its data.
+        """
+        endpoints = iter(endpoints)
+        pending = deque() if ordered else set()
+        try:
+            while True:
+                while len(pending) < concurrency:
+                    endpoint = next(endpoints, None)
+                    if endpoint is None:
+                        break
+                    task = asyncio.ensure_future(self._fetch_one(endpoint))
+                    if ordered:
+                        pending.append(task)
+                    else:
+                        pending.add(task)
+                if not pending:
+                    return
+                if ordered:
+                    yield await pending.popleft()
+                else:
+                    done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                    for task in done:
+                        yield task.result()
+        finally:
+            for task in pending:
+                task.cancel()
+
+    async def _fetch_one(self, endpoint: str) -> Tuple[str, Optional[dict]]:
+        return endpoint, await self.get_authenticated(endpoint)
+
+    async def get_many(self, endpoints: Iterable[str], concurrency: int = BULK_CONCURRENCY) -> List[Optional[dict]]:
+        """GET many endpoints concurrently, returning their data in input order"""
+        return [data async for _, data in self.fetch_many(endpoints, concurrency)]
+
+    async def get_media(self, media_ids: Iterable[int], ordered: bool = True) -> AsyncIterator[Tuple[int, Optional[dict]]]:
+        """Fetch media records concurrently, yielding (media_id, record)"""
+        endpoints = (f"/api/media/{media_id}" for media_id in media_ids)
+        async for endpoint, data in self.fetch_many(endpoints, ordered=ordered):
+            yield int(endpoint.rsplit('/', 1)[1]), data
+
+    async def iter_pages(self, endpoint: str, page_size: int = PAGE_SIZE) -> AsyncIterator[Any]:
+        """Yield the items of a paginated listing one page at a time
+
+        Only the current page is held in memory, the next one is fetched while
+        the caller works through it. Pages bypass the response cache.
+        """
+        separator = '&' if '?' in endpoint else '?'
+        page = 1
+
+        def fetch(page):
+            return asyncio.ensure_future(self.get_authenticated(
+                f"{endpoint}{separator}page={page}&pageSize={page_size}", use_cache=False
+            ))
+
+        next_page = fetch(page)
+        try:
+            while True:
+                data = await next_page
+                next_page = None
+                if data is None:
+                    raise aiohttp.ClientError(f"Fetching page {page} of {endpoint} failed")
+                items = data.get("data", data) if isinstance(data, dict) else data
+                if isinstance(items, dict):
+                    items = items.get("items") or []
+                if len(items) == page_size:
+                    page += 1
+                    next_page = fetch(page)
+                for item in items:
+                    yield item
+                if next_page is None:
+                    return
+        finally:
+            if next_page:
+                next_page.cancel()
+
     def clear_credentials(self) -> None:
         """Clear stored credentials from keyring for this client"""
         service_name = self._get_service_name()
@@ -139,19 +422,110 @@ class MediaAPIClient:
         except Exception as e:
             print(f"Error clearing credentials: {e}")
             
+    @timed
     async def report_playback_time(self, media_id: int, seconds: float) -> bool:
         """Report playback time to server for a specific media item"""
-        if not self.token:
-            raise ValueError("Not authenticated")
-
         try:
-            async with self.session.post(
-                f"{self.base_url}/api/media/playback",
-                headers={"Authorization": f"Bearer {self.token}"},
+            async with await self._send_authenticated(
+                "POST",
+                "/api/media/playback",
                 json={"mediaId": media_id, "position": seconds}
             ) as response:
                 response.raise_for_status()
                 return True
         except aiohttp.ClientError as e:
             print(f"Failed to report playback time: {e}")
-            return False
\ No newline at end of file
+            return False
+
+    @timed
+    async def report_playback_times(self, positions: Dict[int, float]) -> bool:
+        """Report playback times for several media items, batched when the server supports it"""
+        if not positions:
+            return True
+
+        if self.batch_reporting is not False:
+            try:
+                async with await self._send_authenticated(
+                    "POST",
+                    "/api/media/playback/batch",
+                    json={"items": [
+                        {"mediaId": media_id, "position": seconds}
+                        for media_id, seconds in positions.items()
+                    ]}
+                ) as response:
+                    if response.status in (404, 405, 501):
+                        # Server has no batch endpoint, use single reports from now on
+                        self.batch_reporting = False
+                    else:
+                        response.raise_for_status()
+                        self.batch_reporting = True
+                        return True
+            except aiohttp.ClientError as e:
+                print(f"Failed to report playback times: {e}")
+                return False
+
+        results = await asyncio.gather(*(
+            self.report_playback_time(media_id, seconds)
+            for media_id, seconds in positions.items()
+        ))
+        return all(results)
+
+    @timed
+    async def get_playback_position(self, media_id: int) -> Optional[float]:
+        """Fetch the saved playback position of a media item, None if there is none"""
+        try:
+            async with await self._send_authenticated(
+                "GET", f"/api/media/playback/{media_id}"
+            ) as response:
+                if response.status == 404:
+                    return None
+                response.raise_for_status()
+                data = await response.json()
+        except aiohttp.ClientError as e:
+            print(f"Failed to fetch playback position: {e}")
+            return None
+
+        position = (data.get("data") or data).get("position")
+        return float(position) if position else None
+
+    def stream_url(self, media_id: int) -> str:
+        """URL of the stream for a media item, on the preferred server"""
+        base_url = self.servers.preferred if self.servers else self.base_url
+        return f"{base_url}{stream_path(media_id)}"
+
+    def route(self, url: str) -> str:
+        """Move a stream URL or path, or any URL on one of the mirrors, to the preferred server"""
+        preferred = self.servers.preferred if self.servers else self.base_url
+        match = _STREAM_URL.match(url)
+        if match:
+            return f"{preferred}{match.group(1)}"
+        if self.servers:
+            for base_url in self.servers.urls:
+                if url.startswith(f"{base_url}/"):
+                    return f"{preferred}{url[len(base_url):]}"
+        return url
+
+    @timed
+    async def probe_stream(self, url: str, use_cache: bool = True) -> Optional[int]:
+        """Check that a stream is available without reading its body, returns the HTTP status"""
+        cached = self._preflight_cache.get(url)
+        if use_cache and cached and time.monotonic() - cached[0] < self.preflight_ttl:
+            return cached[1]
+
+        try:
+            async with self.session.head(url, allow_redirects=True) as response:
+                status = response.status
+
+            if status in (405, 501):
+                # No HEAD support, ask for a single byte instead of the whole file
+                async with self.session.get(url, headers={"Range": "bytes=0-0"}) as response:
+                    status = 200 if response.status == 206 else response.status
+        except aiohttp.ClientError as e:
+            print(f"Stream pre-flight failed: {e}")
+            return None
+
+        if status == 200:
+            self._preflight_cache[url] = (time.monotonic(), status)
+        else:
+            self._preflight_cache.pop(url, None)
+        return status
@@ -0,0 +1,121 @@
+import functools
+import json
+import time
+from bisect import bisect_left
+from typing import Callable, Dict, Optional, Sequence
+
+from aiohttp import web
+
+# Upper bounds in seconds, wide enough for both API round-trips and stalls
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+
+class Histogram:
+    """Fixed-bucket histogram, one bisect and three increments per observation"""
+
+    __slots__ = ('buckets', 'counts', 'count', 'sum')
+
+    def __init__(self, buckets: Sequence[float] = LATENCY_BUCKETS):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)  # Last slot counts values above every bucket
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value: float) -> None:
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+
+    def snapshot(self) -> dict:
+        """Count, sum and cumulative count per upper bound"""
+        cumulative, buckets = 0, {}
+        for bound, count in zip(self.buckets + ('+Inf',), self.counts):
+            cumulative += count
+            buckets[str(bound)] = cumulative
+        return {'count': self.count, 'sum': round(self.sum, 6), 'buckets': buckets}
+
+
+class Metrics:
+    """In-process counters, histograms and gauges, not thread-safe, use from the loop
+
+    Gauges are callables read only when a snapshot is taken, so values that
+    already live elsewhere (queue lengths, player properties) cost nothing
+    to track.
+    """
+
+    def __init__(self):
+        self.counters: Dict[str, int] = {}
+        self.histograms: Dict[str, Histogram] = {}
+        self.gauges: Dict[str, Callable[[], Optional[float]]] = {}
+
+    def increment(self, name: str, amount: int = 1) -> None:
+        self.counters[name] = self.counters.get(name, 0) + amount
+
+    def observe(self, name: str, value: float) -> None:
+        histogram = self.histograms.get(name)
+        if histogram is None:
+            histogram = self.histograms[name] = Histogram()
+        histogram.observe(value)
+
+    def gauge(self, name: str, read: Callable[[], Optional[float]]) -> None:
+        """Register a callable returning the current value of a gauge"""
+        self.gauges[name] = read
+
+    def snapshot(self) -> dict:
+        gauges = {}
+        for name, read in self.gauges.items():
+            try:
+                gauges[name] = read()
+            except Exception as e:
+                print(f"Reading gauge {name} failed: {e}")
+        return {
+            'counters': dict(self.counters),
+            'gauges': gauges,
+            'histograms': {name: h.snapshot() for name, h in self.histograms.items()},
+        }
+
+
+def timed(method):
+    """Record the latency of an async method in self.metrics under api.<method name>
+
+    Costs a single attribute check when the instance has no metrics.
+    """
+    name = f"api.{method.__name__}"
+
+    @functools.wraps(method)
+    async def wrapper(self, *args, **kwargs):
+        metrics = self.metrics
+        if metrics is None:
+            return await method(self, *args, **kwargs)
+        start = time.perf_counter()
+        try:
+            return await method(self, *args, **kwargs)
+        finally:
+            metrics.observe(name, time.perf_counter() - start)
+    return wrapper
+
+
+class MetricsServer:
+    """Serves Metrics.snapshot() as JSON on http://host:port/metrics"""
+
+    def __init__(self, metrics: Metrics, host: str = '127.0.0.1', port: int = 0):
+        self.metrics = metrics
+        self.host = host
+        self.port = port
+        self._runner: Optional[web.AppRunner] = None
+
+    async def start(self) -> None:
+        app = web.Application()
+        app.router.add_get('/metrics', self._handle_metrics)
+        self._runner = web.AppRunner(app, access_log=None)
+        await self._runner.setup()
+        await web.TCPSite(self._runner, self.host, self.port).start()
+        self.port = self._runner.addresses[0][1]
+
+    async def stop(self) -> None:
+        if self._runner:
+            await self._runner.cleanup()
+            self._runner = None
+
+    async def _handle_metrics(self, request: web.Request) -> web.Response:
+        return web.Response(text=json.dumps(self.metrics.snapshot()), content_type='application/json')
@@ -0,0 +1,150 @@
+import asyncio
+import json
+import os
+from typing import Dict, Optional, Set
+
+import aiohttp
+
+DOWNLOAD_CHUNK_SIZE = 8 * 1024 * 1024  # Bytes per Range request
+WRITE_SIZE = 256 * 1024  # Bytes written to disk at a time
+
+
+class OfflineDownloader:
+    """Downloads media for offline playback over several concurrent Range requests
+
+    Every chunk is written straight into a preallocated file at its offset.
+    Finished chunks are recorded in a small sidecar progress file, so an
+    interrupted download resumes where it stopped. A media item counts as
+    available offline once its sidecar is gone.
+    """
+
+    def __init__(self, client, directory: str, connections: int = 4,
+                 chunk_size: int = DOWNLOAD_CHUNK_SIZE):
+        self.client = client
+        self.directory = directory
+        self.connections = connections
+        self.chunk_size = chunk_size
+        self._downloads: Dict[int, asyncio.Task] = {}
+        os.makedirs(directory, exist_ok=True)
+
+    def _media_path(self, media_id: int) -> str:
+        return os.path.join(self.directory, f"{media_id}.media")
+
+    def _progress_path(self, media_id: int) -> str:
+        return os.path.join(self.directory, f"{media_id}.progress")
+
+    def local_path(self, media_id: Optional[int]) -> Optional[str]:
+        """Return the local copy of a media item if it has been downloaded completely"""
+        if media_id is None:
+            return None
+        path = self._media_path(media_id)
+        if os.path.exists(path) and not os.path.exists(self._progress_path(media_id)):
+            return path
+        return None
+
+    def download(self, media_id: int) -> "asyncio.Task[Optional[str]]":
+        """Start downloading a media item, or return the download already running"""
+        task = self._downloads.get(media_id)
+        if task is None or task.done():
+            task = asyncio.ensure_future(self._download(media_id))
+            self._downloads[media_id] = task
+            task.add_done_callback(lambda _: self._downloads.pop(media_id, None))
+        return task
+
+    async def cancel_all(self) -> None:
+        """Stop running downloads, their progress is kept for resuming"""
+        tasks = list(self._downloads.values())
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    async def _get_size(self, url: str) -> int:
+        async with self.client.session.get(url, headers={"Range": "bytes=0-0"}) as response:
+            response.raise_for_status()
+            if response.status != 206:
+                raise ValueError("Server does not support Range requests")
+            return int(response.headers["Content-Range"].rsplit('/', 1)[1])
+
+    def _load_progress(self, media_id: int, size: int) -> Set[int]:
+        try:
+            with open(self._progress_path(media_id)) as f:
+                progress = json.load(f)
+        except (OSError, ValueError):
+            return set()
+        # A different size or chunking means the old chunks can't be trusted
+        if progress.get("size") != size or progress.get("chunk_size") != self.chunk_size:
+            return set()
+        return set(progress.get("done", []))
+
+    def _save_progress(self, media_id: int, size: int, done: Set[int]) -> None:
+        path = self._progress_path(media_id)
+        with open(path + '.tmp', 'w') as f:
+            json.dump({"size": size, "chunk_size": self.chunk_size, "done": sorted(done)}, f)
+        os.replace(path + '.tmp', path)
+
+    async def _download(self, media_id: int) -> Optional[str]:
+        if self.local_path(media_id):
+            return self._media_path(media_id)
+
+        url = self.client.stream_url(media_id)
+        path = self._media_path(media_id)
+        loop = asyncio.get_running_loop()
+        try:
+            size = await self._get_size(url)
+            done = self._load_progress(media_id, size)
+            fresh = not done or not os.path.exists(path)
+            if fresh:
+                done = set()
+            # The sidecar goes first, a crash before it would leave a zero-filled file that looks complete
+            self._save_progress(media_id, size, done)
+            if fresh:
+                with open(path, 'wb') as f:
+                    f.truncate(size)  # Preallocate so chunks can land at any offset
+
+            pending: asyncio.Queue = asyncio.Queue()
+            for index in range((size + self.chunk_size - 1) // self.chunk_size):
+                if index not in done:
+                    pending.put_nowait(index)
+
+            async def worker():
+                with open(path, 'r+b') as f:
+                    while not pending.empty():
+                        index = pending.get_nowait()
+                        await self._fetch_chunk(url, f, index, size, loop)
+                        done.add(index)
+                        self._save_progress(media_id, size, done)
+
+            print(f"Downloading media {media_id}: {pending.qsize()} chunk(s) left")
+            workers = [asyncio.ensure_future(worker()) for _ in range(self.connections)]
+            try:
+                await asyncio.gather(*workers)
+            finally:
+                # One failed connection stops the others, progress so far is kept
+                for task in workers:
+                    task.cancel()
+                await asyncio.gather(*workers, return_exceptions=True)
+        except (aiohttp.ClientError, ValueError, OSError) as e:
+            print(f"Download of media {media_id} interrupted: {e}")
+            return None
+
+        os.remove(self._progress_path(media_id))
+        print(f"Media {media_id} available offline at {path}")
+        return path
+
+    async def _fetch_chunk(self, url: str, f, index: int, size: int, loop) -> None:
+        start = index * self.chunk_size
+        end = min(start + self.chunk_size, size) - 1
+        async with self.client.session.get(url, headers={"Range": f"bytes={start}-{end}"}) as response:
+            if response.status != 206:
+                raise ValueError(f"Expected a partial response, got HTTP {response.status}")
+            offset = start
+            async for piece in response.content.iter_chunked(WRITE_SIZE):
+                await loop.run_in_executor(None, self._write_at, f, offset, piece)
+                offset += len(piece)
+        if offset != end + 1:
+            raise ValueError(f"Chunk {index} ended early")
+
+    @staticmethod
+    def _write_at(f, offset: int, data: bytes) -> None:
+        f.seek(offset)
+        f.write(data)
@@ -0,0 +1,57 @@
+import asyncio
+import time
+from typing import Awaitable, Callable, Optional
+
+
+class PlayScheduler:
+    """Runs play requests on the loop one at a time, the latest request wins
+
+    A new request cancels the one still in its pre-flight or player setup.
+    Requests arriving within the debounce window of the previous one wait
+    out the window first, so a burst of clicks costs a single startup.
+    """
+
+    def __init__(self, play: Callable[[Optional[str]], Awaitable[None]], debounce: float = 0.15):
+        self.play = play
+        self.debounce = debounce
+        self.superseded = 0  # Requests cancelled by a newer one
+        self._task: Optional[asyncio.Task] = None
+        self._last_request = float('-inf')
+        self._transition = asyncio.Lock()
+
+    def request(self, url: Optional[str] = None) -> asyncio.Task:
+        """Schedule playback of url, cancelling any request that has not finished yet"""
+        now = time.monotonic()
+        burst = now - self._last_request < self.debounce
+        self._last_request = now
+
+        if self._task and not self._task.done():
+            self._task.cancel()
+            self.superseded += 1
+            burst = True
+        self._task = asyncio.ensure_future(self._run(url, self.debounce if burst else 0))
+        self._task.add_done_callback(self._log_failure)
+        return self._task
+
+    @staticmethod
+    def _log_failure(task: asyncio.Task) -> None:
+        if not task.cancelled() and task.exception():
+            print(f"Play request failed: {task.exception()!r}")
+
+    async def _run(self, url: Optional[str], delay: float) -> None:
+        if delay:
+            await asyncio.sleep(delay)
+        async with self._transition:
+            await self.play(url)
+
+    async def after_pending(self, action: Callable[..., Awaitable], *args):
+        """Run another player transition once the pending play request has settled"""
+        if self._task:
+            await asyncio.gather(asyncio.shield(self._task), return_exceptions=True)
+        async with self._transition:
+            return await action(*args)
+
+    async def cancel(self) -> None:
+        if self._task:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
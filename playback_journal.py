@@ -0,0 +1,114 @@
+import os
+import time
+from typing import Dict
+
+FSYNC_POLICIES = ('always', 'interval', 'never')
+
+
+class PlaybackJournal:
+    """Append-only local journal of playback positions not yet confirmed by the server
+
+    Each line is a record: ``P <media_id> <position>`` when a position is
+    written ahead of reporting it and ``A <media_id> <position>`` once the
+    server accepted it. Replaying the lines in order leaves the latest
+    unacknowledged position per media_id. A torn last line after a crash is
+    ignored. Not thread-safe, callers must serialize access.
+    """
+
+    def __init__(self, path: str, fsync: str = 'interval', fsync_interval: float = 5,
+                 compact_after: int = 1000):
+        if fsync not in FSYNC_POLICIES:
+            raise ValueError(f"fsync must be one of {', '.join(FSYNC_POLICIES)}")
+        self.path = path
+        self.fsync = fsync
+        self.fsync_interval = fsync_interval
+        self.compact_after = compact_after  # Records written before rewriting the file
+        self._pending: Dict[int, str] = {}  # media_id -> position as written
+        self._records = 0
+        self._last_sync = 0.0
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        self._replay()
+        self._file = open(path, 'a', encoding='ascii')
+
+    def _replay(self) -> None:
+        try:
+            with open(self.path, encoding='ascii', errors='replace') as f:
+                for line in f:
+                    parts = line.split()
+                    if len(parts) != 3 or parts[0] not in ('P', 'A'):
+                        continue
+                    try:
+                        media_id, position = int(parts[1]), parts[2]
+                        float(position)
+                    except ValueError:
+                        continue
+                    self._records += 1
+                    if parts[0] == 'P':
+                        self._pending[media_id] = position
+                    elif self._pending.get(media_id) == position:
+                        del self._pending[media_id]
+        except FileNotFoundError:
+            pass
+
+    def pending(self) -> Dict[int, float]:
+        """Latest position per media_id the server has not acknowledged"""
+        return {media_id: float(position) for media_id, position in self._pending.items()}
+
+    def append(self, positions: Dict[int, float]) -> None:
+        """Write positions ahead of reporting them, skipping ones already journaled"""
+        lines = []
+        for media_id, position in positions.items():
+            text = f"{position:.3f}"
+            if self._pending.get(media_id) != text:
+                self._pending[media_id] = text
+                lines.append(f"P {media_id} {text}\n")
+        self._write(lines)
+
+    def ack(self, positions: Dict[int, float]) -> None:
+        """Mark positions as accepted by the server"""
+        lines = []
+        for media_id, position in positions.items():
+            text = f"{position:.3f}"
+            if self._pending.get(media_id) == text:
+                del self._pending[media_id]
+                lines.append(f"A {media_id} {text}\n")
+        self._write(lines)
+
+    def _write(self, lines) -> None:
+        if not lines:
+            return
+        self._file.write(''.join(lines))
+        self._file.flush()
+        self._records += len(lines)
+
+        now = time.monotonic()
+        if self.fsync == 'always' or (
+            self.fsync == 'interval' and now - self._last_sync >= self.fsync_interval
+        ):
+            os.fsync(self._file.fileno())
+            self._last_sync = now
+
+        # On every write, so the file stays bounded in an outage when nothing gets acknowledged.
+        # A backlog larger than compact_after is only rewritten once it has doubled.
+        if self._records >= max(self.compact_after, 2 * len(self._pending)):
+            self.compact()
+
+    def compact(self) -> None:
+        """Rewrite the journal with only the pending positions"""
+        temp_path = self.path + '.tmp'
+        with open(temp_path, 'w', encoding='ascii') as f:
+            for media_id, position in self._pending.items():
+                f.write(f"P {media_id} {position}\n")
+            f.flush()
+            if self.fsync != 'never':
+                os.fsync(f.fileno())
+        self._file.close()
+        os.replace(temp_path, self.path)
+        self._file = open(self.path, 'a', encoding='ascii')
+        self._records = len(self._pending)
+
+    def close(self) -> None:
+        self._file.flush()
+        if self.fsync != 'never':
+            os.fsync(self._file.fileno())
+        self._file.close()
@@ -0,0 +1,106 @@
+import asyncio
+import threading
+from typing import Callable, Dict, Optional
+
+from playback_journal import PlaybackJournal
+
+REPLAY_BATCH_SIZE = 50  # Positions sent per request when draining a backlog
+
+
+class PlaybackReporter:
+    """Coalesces playback positions and reports them to the server in batches
+
+    With a journal, every flush is written ahead to disk and acknowledged
+    once the server accepted it, so positions survive outages and restarts.
+    Unacknowledged positions are replayed on the next flushes.
+    """
+
+    def __init__(self, client, interval: float = 10, journal: Optional[PlaybackJournal] = None,
+                 on_flush: Optional[Callable[[Dict[int, float]], None]] = None):
+        self.client = client
+        self.interval = interval
+        self.journal = journal
+        self.on_flush = on_flush  # Sees every flushed set of positions, called on the loop
+        # Latest unreported position per media_id, starting with what a previous run left behind
+        self.pending: Dict[int, float] = journal.pending() if journal else {}
+        self._lock = threading.Lock()
+        self._flush_lock = asyncio.Lock()
+        self._task: Optional[asyncio.Task] = None
+
+    def update(self, media_id: Optional[int], position: float) -> None:
+        """Record the latest position for a media item, safe to call from any thread"""
+        if media_id is None:
+            return
+        with self._lock:
+            self.pending[media_id] = position
+
+    def start(self) -> None:
+        """Start the periodic flush task on the running loop"""
+        if self._task is None:
+            self._task = asyncio.ensure_future(self._run())
+
+    def request_flush(self) -> None:
+        """Schedule a flush without waiting for it, must be called on the loop"""
+        asyncio.ensure_future(self.flush())
+
+    async def _run(self) -> None:
+        try:
+            while True:
+                await asyncio.sleep(self.interval)
+                try:
+                    await self.flush()
+                except Exception as e:
+                    print(f"Playback report flush failed: {e}")
+        except asyncio.CancelledError:
+            pass
+
+    async def flush(self) -> None:
+        """Send all pending positions to the server"""
+        async with self._flush_lock:
+            with self._lock:
+                pending, self.pending = self.pending, {}
+
+            if not pending:
+                return
+            if self.on_flush:
+                self.on_flush(pending)
+            loop = asyncio.get_running_loop()
+            items = list(pending.items())
+            start = 0
+            try:
+                if self.journal:
+                    await loop.run_in_executor(None, self.journal.append, pending)
+                if not self.client:
+                    self._requeue(pending)
+                    return
+
+                # Without a token the client tries to log in again and reports a failure if it can't
+                for start in range(0, len(items), REPLAY_BATCH_SIZE):
+                    batch = dict(items[start:start + REPLAY_BATCH_SIZE])
+                    if not await self.client.report_playback_times(batch):
+                        # Server unreachable, keep the rest for the next flush
+                        self._requeue(dict(items[start:]))
+                        return
+                    if self.journal:
+                        await loop.run_in_executor(None, self.journal.ack, batch)
+                    for media_id, position in batch.items():
+                        print(f"Reported position {position:.2f}s for media {media_id}")
+            except Exception as e:
+                print(f"Failed to report playback positions: {e}")
+                self._requeue(dict(items[start:]))
+
+    def _requeue(self, positions: Dict[int, float]) -> None:
+        # Keep failed positions unless a newer one arrived in the meantime
+        with self._lock:
+            for media_id, position in positions.items():
+                self.pending.setdefault(media_id, position)
+
+    async def close(self) -> None:
+        """Stop the periodic task and flush what is left"""
+        if self._task:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+        await self.flush()
+        if self.journal:
+            self.journal.close()
@@ -0,0 +1,85 @@
+import asyncio
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+
+class LatestValue:
+    """Single-slot holder that only ever keeps the newest value written to it
+
+    Meant for exactly one writer thread (the mpv event thread). Writes replace
+    a (version, value) tuple in one assignment, so readers on other threads
+    never see a torn update and no lock is needed.
+    """
+
+    __slots__ = ('_slot',)
+
+    def __init__(self, value: Any = None):
+        self._slot: Tuple[int, Any] = (0, value)
+
+    def set(self, value: Any) -> None:
+        self._slot = (self._slot[0] + 1, value)
+
+    def get(self) -> Tuple[int, Any]:
+        """Return the (version, value) pair last written"""
+        return self._slot
+
+    @property
+    def value(self) -> Any:
+        return self._slot[1]
+
+
+class PropertySampler:
+    """Samples a set of LatestValue slots from the asyncio loop at a fixed rate
+
+    Callbacks run on the loop, once per sample in which the slot was written,
+    so their count follows the sample rate rather than the rate of updates.
+    """
+
+    def __init__(self, rate: float = 4):
+        self.rate = rate  # Samples per second
+        self.slots: Dict[str, LatestValue] = {}
+        self._seen: Dict[str, int] = {}
+        self._callbacks: Dict[str, List[Callable[[Any], None]]] = {}
+        self._task: Optional[asyncio.Task] = None
+
+    def attach(self, slots: Dict[str, LatestValue]) -> None:
+        """Sample from a new set of slots, e.g. after the player was replaced"""
+        self.slots = slots
+        self._seen = {name: slot.get()[0] for name, slot in slots.items()}
+
+    def subscribe(self, name: str, callback: Callable[[Any], None]) -> None:
+        """Register a callback for changes of a single property"""
+        self._callbacks.setdefault(name, []).append(callback)
+
+    def sample(self) -> None:
+        """Dispatch every slot written since the previous sample"""
+        for name, slot in self.slots.items():
+            version, value = slot.get()
+            if version == self._seen.get(name):
+                continue
+            self._seen[name] = version
+            for callback in self._callbacks.get(name, ()):
+                try:
+                    callback(value)
+                except Exception as e:
+                    print(f"Property callback for {name} failed: {e}")
+
+    def start(self) -> None:
+        """Start the sampling task on the running loop"""
+        if self._task is None:
+            self._task = asyncio.ensure_future(self._run())
+
+    async def _run(self) -> None:
+        try:
+            while True:
+                await asyncio.sleep(1 / self.rate)
+                self.sample()
+        except asyncio.CancelledError:
+            pass
+
+    async def stop(self) -> None:
+        """Stop sampling, dispatching whatever was written last"""
+        if self._task:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+        self.sample()
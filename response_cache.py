@@ -0,0 +1,90 @@
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Hashable, Optional
+
+
+class CacheEntry:
+    __slots__ = ('data', 'size', 'etag', 'last_modified', 'expires')
+
+    def __init__(self, data: Any, size: int, etag: Optional[str],
+                 last_modified: Optional[str], expires: float):
+        self.data = data
+        self.size = size
+        self.etag = etag
+        self.last_modified = last_modified
+        self.expires = expires
+
+    @property
+    def fresh(self) -> bool:
+        return time.monotonic() < self.expires
+
+    @property
+    def validators(self) -> Dict[str, str]:
+        """Headers that turn a GET for this entry into a conditional request"""
+        headers = {}
+        if self.etag:
+            headers["If-None-Match"] = self.etag
+        if self.last_modified:
+            headers["If-Modified-Since"] = self.last_modified
+        return headers
+
+
+class ResponseCache:
+    """LRU cache of decoded JSON responses with a TTL and a memory cap
+
+    Entries past their TTL are kept and revalidated with a conditional
+    request rather than dropped. Cached objects are shared between callers
+    and must not be modified.
+    """
+
+    def __init__(self, max_entries: int = 256, max_bytes: int = 8 * 1024 * 1024, ttl: float = 60):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes  # Measured as the size of the response bodies
+        self.ttl = ttl
+        self.total_bytes = 0
+        self._entries: "OrderedDict[Hashable, CacheEntry]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.revalidations = 0
+        self.evictions = 0
+
+    def get(self, key: Hashable) -> Optional[CacheEntry]:
+        entry = self._entries.get(key)
+        if entry is not None:
+            self._entries.move_to_end(key)
+        return entry
+
+    def put(self, key: Hashable, data: Any, size: int,
+            etag: Optional[str] = None, last_modified: Optional[str] = None) -> None:
+        self.discard(key)
+        if size > self.max_bytes:
+            return
+        self._entries[key] = CacheEntry(data, size, etag, last_modified, time.monotonic() + self.ttl)
+        self.total_bytes += size
+        while len(self._entries) > self.max_entries or self.total_bytes > self.max_bytes:
+            _, evicted = self._entries.popitem(last=False)
+            self.total_bytes -= evicted.size
+            self.evictions += 1
+
+    def refresh(self, entry: CacheEntry) -> None:
+        """Restart the TTL of an entry the server confirmed unchanged"""
+        entry.expires = time.monotonic() + self.ttl
+
+    def discard(self, key: Hashable) -> None:
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self.total_bytes -= entry.size
+
+    def clear(self) -> None:
+        self._entries.clear()
+        self.total_bytes = 0
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "entries": len(self._entries),
+            "bytes": self.total_bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "revalidations": self.revalidations,
+            "evictions": self.evictions,
+        }
@@ -0,0 +1,134 @@
+import asyncio
+import time
+from typing import Dict, List, Optional, Sequence
+
+import aiohttp
+
+PROBE_TIMEOUT = 3  # Seconds before a probe counts as failed
+SWITCH_MARGIN = 0.8  # A faster server must beat the preferred one's RTT by this factor
+
+
+class ServerState:
+    """Round-trip time and circuit breaker of one server
+
+    The breaker opens after failure_threshold consecutive failures and keeps
+    the server out of rotation for reset_timeout seconds. After that it is
+    half-open: the next probe or request decides whether it closes again.
+    """
+
+    __slots__ = ('url', 'rtt', 'failures', 'opened_at')
+
+    def __init__(self, url: str):
+        self.url = url
+        self.rtt: Optional[float] = None  # Smoothed seconds, None until a probe succeeded
+        self.failures = 0
+        self.opened_at: Optional[float] = None
+
+    def available(self, reset_timeout: float) -> bool:
+        """Closed, or open long enough to be tried again"""
+        return self.opened_at is None or time.monotonic() - self.opened_at >= reset_timeout
+
+
+class ServerPool:
+    """Mirrors of the same library, routing to the fastest healthy one
+
+    Servers are probed concurrently for their round-trip time on start and
+    every probe_interval seconds after. Callers report request outcomes with
+    record_success / record_failure, which drive the circuit breakers.
+    """
+
+    def __init__(self, urls: Sequence[str], failure_threshold: int = 3,
+                 reset_timeout: float = 30, probe_interval: float = 60):
+        if not urls:
+            raise ValueError("At least one server URL is required")
+        self.servers: Dict[str, ServerState] = {url: ServerState(url) for url in urls}
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.probe_interval = probe_interval
+        self.preferred = urls[0]
+        self._task: Optional[asyncio.Task] = None
+
+    @property
+    def urls(self) -> List[str]:
+        return list(self.servers)
+
+    async def probe(self, session: aiohttp.ClientSession, url: str) -> Optional[float]:
+        """Measure one round-trip to a server, any HTTP response below 500 counts as alive"""
+        start = time.perf_counter()
+        try:
+            async with session.head(
+                f"{url}/", timeout=aiohttp.ClientTimeout(total=PROBE_TIMEOUT)
+            ) as response:
+                healthy = response.status < 500
+        except (aiohttp.ClientError, asyncio.TimeoutError):
+            healthy = False
+
+        if not healthy:
+            self.record_failure(url)
+            return None
+        rtt = time.perf_counter() - start
+        state = self.servers[url]
+        state.rtt = rtt if state.rtt is None else (state.rtt + rtt) / 2
+        self.record_success(url)
+        return rtt
+
+    async def probe_all(self, session: aiohttp.ClientSession) -> str:
+        """Probe every server at once, then return the preferred one"""
+        await asyncio.gather(*(self.probe(session, url) for url in self.servers))
+        self._update_preferred()
+        return self.preferred
+
+    def start(self, session: aiohttp.ClientSession) -> None:
+        """Re-probe in the background on the running loop"""
+        if self._task is None and len(self.servers) > 1:
+            self._task = asyncio.ensure_future(self._run(session))
+
+    async def _run(self, session: aiohttp.ClientSession) -> None:
+        try:
+            while True:
+                await asyncio.sleep(self.probe_interval)
+                await self.probe_all(session)
+        except asyncio.CancelledError:
+            pass
+
+    async def stop(self) -> None:
+        if self._task:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+    def record_success(self, url: str) -> None:
+        state = self.servers.get(url)
+        if state:
+            state.failures = 0
+            state.opened_at = None
+
+    def record_failure(self, url: str) -> None:
+        state = self.servers.get(url)
+        if not state:
+            return
+        state.failures += 1
+        if state.failures >= self.failure_threshold or state.opened_at is not None:
+            # Trips the breaker, or re-opens it after a failed half-open attempt
+            if state.opened_at is None:
+                print(f"Server {url} failed {state.failures} times, taking it out of rotation")
+            state.opened_at = time.monotonic()
+            self._update_preferred()
+
+    def _update_preferred(self) -> None:
+        available = [s for s in self.servers.values() if s.available(self.reset_timeout)]
+        if not available:
+            return  # Every breaker is open, stay where we are until one resets
+        current = self.servers[self.preferred]
+        measured = [s for s in available if s.rtt is not None]
+        fastest = min(measured, key=lambda s: s.rtt) if measured else available[0]
+        if current not in available or fastest.rtt is not None and (
+            current.rtt is None or fastest.rtt < current.rtt * SWITCH_MARGIN
+        ):
+            self.preferred = fastest.url
+
+    def status(self) -> dict:
+        return {
+            url: {'rtt': state.rtt, 'failures': state.failures, 'open': state.opened_at is not None}
+            for url, state in self.servers.items()
+        }
@@ -0,0 +1,30 @@
+import os
+
+# Configuration shared by the launcher and the tray application
+USERNAME = 'Stolan'
+PASSWORD = '123'
+DEFAULT_MEDIA_ID = 1  # Played by 'Play Default' and by play requests that name no item
+SERVER_URLS = ["http://localhost:8112"]  # Mirrors of the library, the fastest healthy one is used
+PROTOCOL_HANDLER = 'nostromoshim'
+SAMPLE_RATE = 4  # Player property samples per second
+PLAY_DEBOUNCE = 0.15  # Seconds a burst of play requests is coalesced over
+PREFLIGHT = True  # Check the stream with HEAD before handing it to mpv
+RESUME_PLAYBACK = True  # Start items at their saved position
+PREFETCH_LEAD = 30  # Seconds before the end of an item the next queued one is prefetched
+ADAPTIVE_BUFFERING = True  # Size mpv's cache from the measured throughput
+ADAPTIVE_BITRATE_PARAM = 'maxBitrate'  # Stream query parameter asking the server for a lower bitrate
+STREAM_CACHE = False  # Serve streams to mpv through the local caching proxy
+STREAM_CACHE_DIR = os.path.join(os.path.expanduser('~'), '.nostromoshim', 'cache')
+STREAM_CACHE_SIZE = 2 * 1024 ** 3  # Bytes kept on disk
+OFFLINE_DIR = os.path.join(os.path.expanduser('~'), '.nostromoshim', 'offline')
+DOWNLOAD_CONNECTIONS = 4  # Concurrent Range requests per offline download
+JOURNAL_PATH = os.path.join(os.path.expanduser('~'), '.nostromoshim', 'playback.journal')
+JOURNAL_FSYNC = 'interval'  # 'always', 'interval' or 'never'
+LIBRARY_INDEX_PATH = os.path.join(os.path.expanduser('~'), '.nostromoshim', 'library.sqlite3')
+LIBRARY_SYNC_INTERVAL = 300  # Seconds between delta syncs of the library index
+METRICS = False  # Collect playback and API metrics, served by the IPC 'stats' command
+METRICS_PORT = None  # Also serve them as JSON on http://127.0.0.1:<port>/metrics when set
+MPV_OPTIONS = {}  # Extra mpv options for the player, e.g. {'vo': 'null'} to run headless
+
+SW_RESTORE = 9
+SW_SHOW = 5
@@ -0,0 +1,357 @@
+"""Soak test for the long-running tray application
+
+Drives a tray instance through thousands of IPC play/stop cycles against a
+stand-in server, sampling resident memory, traced Python allocations,
+thread count and open file descriptors (handles on Windows) as it goes.
+Past the warm-up, each is fitted with a least-squares slope per 1000 cycles
+and the run fails when a slope exceeds its limit:
+
+    python soak_test.py --cycles 5000 --max-rss-slope 4 --json soak.json
+
+The tray icon and protocol handler registration are skipped and mpv runs
+headless. State goes to a temporary directory, so the user's journal,
+library index and caches are left alone. The stand-in runs in its own
+process to keep it out of the measurements. Stop any running instance
+first, the IPC port and socket are shared.
+"""
+import argparse
+import ctypes
+import gc
+import json
+import os
+import platform
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+
+from benchmark import use_memory_keyring
+from ipc_protocol import IPCClient, IPCError
+
+STAND_IN_PORT = 8113  # Off the real server's default port
+MEDIA_COUNT = 50  # Distinct media ids the cycles rotate through
+HEADLESS = dict(vo='null', ao='null', force_window='no')
+REPO_DIR = os.path.dirname(os.path.abspath(__file__))
+MIB = 1024 * 1024
+
+# Growth limits per 1000 cycles, past the warm-up
+DEFAULT_MAX_RSS_SLOPE = 8  # MiB
+DEFAULT_MAX_TRACED_SLOPE = 1  # MiB
+DEFAULT_MAX_THREAD_SLOPE = 0.5
+DEFAULT_MAX_FD_SLOPE = 0.5
+
+
+class _ProcessMemoryCounters(ctypes.Structure):
+    _fields_ = [('cb', ctypes.c_ulong), ('PageFaultCount', ctypes.c_ulong)] + [
+        (name, ctypes.c_size_t) for name in (
+            'PeakWorkingSetSize', 'WorkingSetSize', 'QuotaPeakPagedPoolUsage', 'QuotaPagedPoolUsage',
+            'QuotaPeakNonPagedPoolUsage', 'QuotaNonPagedPoolUsage', 'PagefileUsage', 'PeakPagefileUsage'
+        )
+    ]
+
+
+def rss_bytes():
+    """Resident set size of this process, None where it can't be read"""
+    if sys.platform == 'win32':
+        counters = _ProcessMemoryCounters()
+        counters.cb = ctypes.sizeof(counters)
+        kernel32 = ctypes.windll.kernel32
+        if kernel32.K32GetProcessMemoryInfo(kernel32.GetCurrentProcess(), ctypes.byref(counters), counters.cb):
+            return counters.WorkingSetSize
+        return None
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except OSError:
+        return None
+
+
+def os_thread_count():
+    """Threads of this process including mpv's own, None where they can't be listed"""
+    try:
+        return len(os.listdir('/proc/self/task'))
+    except OSError:
+        return None
+
+
+def open_handle_count():
+    """Open file descriptors, or handles on Windows"""
+    if sys.platform == 'win32':
+        kernel32 = ctypes.windll.kernel32
+        count = ctypes.c_ulong()
+        if kernel32.GetProcessHandleCount(kernel32.GetCurrentProcess(), ctypes.byref(count)):
+            return count.value
+        return None
+    for fd_dir in ('/proc/self/fd', '/dev/fd'):
+        try:
+            return len(os.listdir(fd_dir))
+        except OSError:
+            continue
+    return None
+
+
+def slope(points):
+    """Least-squares slope of (x, y) points, None with fewer than two"""
+    points = [(x, y) for x, y in points if y is not None]
+    if len(points) < 2:
+        return None
+    mean_x = sum(x for x, _ in points) / len(points)
+    mean_y = sum(y for _, y in points) / len(points)
+    spread = sum((x - mean_x) ** 2 for x, _ in points)
+    if not spread:
+        return None
+    return sum((x - mean_x) * (y - mean_y) for x, y in points) / spread
+
+
+def _start_stand_in(port, media=None, bandwidth=None):
+    command = [sys.executable, os.path.join(REPO_DIR, 'stand_in_server.py'), '--port', str(port)]
+    if media:
+        command += ['--media', media]
+    if bandwidth:
+        command += ['--bandwidth', str(bandwidth)]
+    process = subprocess.Popen(command, stdout=subprocess.DEVNULL)
+    deadline = time.monotonic() + 10
+    while True:
+        try:
+            socket.create_connection(('localhost', port), timeout=1).close()
+            return process
+        except OSError:
+            if process.poll() is not None or time.monotonic() > deadline:
+                process.kill()
+                raise RuntimeError(f"Stand-in server did not come up on port {port}")
+            time.sleep(0.1)
+
+
+def _start_tray(state_dir, server_url, timeout=30):
+    """Start the tray application's services in this process, pointed at the stand-in"""
+    import tray_application
+
+    use_memory_keyring()
+    tray_application.SERVER_URLS = [server_url]
+    tray_application.JOURNAL_PATH = os.path.join(state_dir, 'playback.journal')
+    tray_application.LIBRARY_INDEX_PATH = os.path.join(state_dir, 'library.sqlite3')
+    tray_application.OFFLINE_DIR = os.path.join(state_dir, 'offline')
+    tray_application.STREAM_CACHE_DIR = os.path.join(state_dir, 'cache')
+    tray_application.MPV_OPTIONS = dict(tray_application.MPV_OPTIONS, **HEADLESS)
+
+    app = tray_application.TrayApplication()
+    app.start_services().result(timeout)
+
+    deadline = time.monotonic() + timeout
+    while True:
+        try:
+            return app, IPCClient(timeout=timeout).connect()
+        except IPCError:
+            if time.monotonic() > deadline:
+                raise
+            time.sleep(0.1)
+
+
+def _stop_tray(app, ipc, timeout=30):
+    ipc.request('shutdown')
+    ipc.close()
+    deadline = time.monotonic() + timeout
+    while app.loop.is_running() and time.monotonic() < deadline:
+        time.sleep(0.1)
+
+
+def take_sample(cycle, started):
+    """Resource usage after cycle"""
+    gc.collect()  # Cyclic garbage waiting for a collection is not a leak
+    return {
+        'cycle': cycle,
+        'seconds': time.monotonic() - started,
+        'rss': rss_bytes(),
+        'traced': tracemalloc.get_traced_memory()[0],
+        'threads': threading.active_count(),
+        'os_threads': os_thread_count(),
+        'fds': open_handle_count(),
+    }
+
+
+def _snapshot():
+    """Traced allocations, leaving out the harness's own"""
+    return tracemalloc.take_snapshot().filter_traces([
+        tracemalloc.Filter(False, tracemalloc.__file__),
+        tracemalloc.Filter(False, __file__),
+    ])
+
+
+def top_growth(baseline, top=10):
+    """Allocation sites that grew the most since the baseline snapshot"""
+    snapshot = _snapshot()
+    key = 'traceback' if tracemalloc.get_traceback_limit() > 1 else 'lineno'
+    return [
+        {'where': ' <- '.join(str(frame) for frame in stat.traceback),
+         'size_diff': stat.size_diff, 'count_diff': stat.count_diff}
+        for stat in snapshot.compare_to(baseline, key)[:top]
+    ]
+
+
+def _format_sample(sample):
+    def mib(value):
+        return "n/a" if value is None else f"{value / MIB:.1f} MiB"
+
+    def count(value):
+        return "n/a" if value is None else str(value)
+
+    return (f"cycle {sample['cycle']:>6}  rss {mib(sample['rss'])}  traced {mib(sample['traced'])}  "
+            f"threads {sample['threads']}/{count(sample['os_threads'])}  fds {count(sample['fds'])}")
+
+
+def check_slopes(samples, warmup, limits):
+    """Slopes per 1000 cycles past the warm-up, as {metric: (slope, limit, exceeded)}"""
+    steady = [s for s in samples if s['cycle'] > warmup]
+    scale = {'rss': MIB, 'traced': MIB}
+    results = {}
+    for metric, limit in limits.items():
+        fitted = slope([(s['cycle'], s[metric]) for s in steady])
+        if fitted is not None:
+            fitted = fitted * 1000 / scale.get(metric, 1)
+        results[metric] = (fitted, limit, fitted is not None and fitted > limit)
+    return results
+
+
+def soak(cycles, warmup, sample_every, hold, limits, media=None, bandwidth=None,
+         port=STAND_IN_PORT, top=10, snapshot_every=0, frames=1):
+    """Run the soak, returns (samples, slope results, final top allocation growth, failed cycles)
+
+    Snapshots of the traced allocations fragment the heap and show up in
+    the resident memory, so by default only the end of the warm-up and the
+    end of the run are snapshotted. snapshot_every adds snapshots in between.
+    """
+    tracemalloc.start(frames)
+    stand_in = _start_stand_in(port, media, bandwidth)
+    try:
+        with tempfile.TemporaryDirectory(prefix='nostromoshim-soak-') as state_dir:
+            server_url = f"http://localhost:{port}"
+            app, ipc = _start_tray(state_dir, server_url)
+            started = time.monotonic()
+            samples = [take_sample(0, started)]
+            print(_format_sample(samples[0]))
+            baseline, warmup_end = None, warmup
+            failures = 0
+            try:
+                for cycle in range(1, cycles + 1):
+                    media_id = cycle % MEDIA_COUNT + 1
+                    try:
+                        ipc.request('play', url=f"{server_url}/api/media/stream/{media_id}")
+                        time.sleep(hold)
+                        ipc.request('stop')
+                    except IPCError as e:
+                        failures += 1
+                        print(f"cycle {cycle} failed: {e}")
+                    if cycle % sample_every == 0 or cycle == cycles:
+                        sample = take_sample(cycle, started)
+                        # Snapshots come after the readings, growth is measured from the end of the warm-up
+                        if baseline is None and cycle >= warmup:
+                            baseline, warmup_end = _snapshot(), cycle
+                        elif baseline is not None and (
+                            cycle == cycles or snapshot_every and cycle % snapshot_every == 0
+                        ):
+                            sample['top_growth'] = top_growth(baseline, top)
+                        samples.append(sample)
+                        print(_format_sample(sample))
+            finally:
+                _stop_tray(app, ipc)
+    finally:
+        stand_in.terminate()
+        stand_in.wait()
+        tracemalloc.stop()
+
+    growth = samples[-1].get('top_growth', [])
+    return samples, check_slopes(samples, warmup_end, limits), growth, failures
+
+
+def _commit():
+    result = subprocess.run(
+        ["git", "rev-parse", "HEAD"], cwd=REPO_DIR, capture_output=True, text=True
+    )
+    return result.stdout.strip() or None
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--cycles", type=int, default=2000, help="play/stop cycles to run")
+    parser.add_argument("--warmup", type=int, default=200, help="cycles left out of the slope fit")
+    parser.add_argument("--sample-every", type=int, default=50, help="cycles between samples")
+    parser.add_argument("--hold", type=float, default=0.5,
+                        help="seconds between play and stop, above the play debounce")
+    parser.add_argument("--media", help="file the stand-in serves as every stream, synthetic bytes otherwise")
+    parser.add_argument("--bandwidth", type=float, help="stand-in stream bytes per second")
+    parser.add_argument("--port", type=int, default=STAND_IN_PORT, help="stand-in server port")
+    parser.add_argument("--top", type=int, default=10, help="allocation sites to report")
+    parser.add_argument("--frames", type=int, default=1,
+                        help="stack frames kept per allocation, more group the report by traceback")
+    parser.add_argument("--snapshot-every", type=int, default=0,
+                        help="cycles between allocation reports, inflates the resident memory; "
+                             "only the final one by default")
+    parser.add_argument("--max-rss-slope", type=float, default=DEFAULT_MAX_RSS_SLOPE,
+                        help="MiB of resident memory per 1000 cycles")
+    parser.add_argument("--max-traced-slope", type=float, default=DEFAULT_MAX_TRACED_SLOPE,
+                        help="MiB of traced Python allocations per 1000 cycles")
+    parser.add_argument("--max-thread-slope", type=float, default=DEFAULT_MAX_THREAD_SLOPE,
+                        help="threads per 1000 cycles")
+    parser.add_argument("--max-fd-slope", type=float, default=DEFAULT_MAX_FD_SLOPE,
+                        help="open file descriptors or handles per 1000 cycles")
+    parser.add_argument("--json", metavar="PATH", help="also write the samples and slopes as JSON")
+    args = parser.parse_args()
+    if args.warmup >= args.cycles:
+        parser.error("--warmup must be below --cycles")
+
+    limits = {
+        'rss': args.max_rss_slope,
+        'traced': args.max_traced_slope,
+        'threads': args.max_thread_slope,
+        'os_threads': args.max_thread_slope,
+        'fds': args.max_fd_slope,
+    }
+    samples, slopes, growth, failures = soak(
+        args.cycles, args.warmup, args.sample_every, args.hold, limits,
+        args.media, args.bandwidth, args.port, args.top, args.snapshot_every, args.frames
+    )
+
+    print("Top allocation growth since the warm-up")
+    for stat in growth:
+        print(f"  {stat['size_diff'] / 1024:+10.1f} KiB  {stat['count_diff']:+8d}  {stat['where']}")
+
+    print("Slopes per 1000 cycles")
+    exceeded = []
+    for metric, (fitted, limit, over) in slopes.items():
+        if fitted is None:
+            print(f"  {metric:<12} n/a")
+            continue
+        print(f"  {metric:<12} {fitted:10.2f}  limit {limit:g}  {'EXCEEDED' if over else 'ok'}")
+        if over:
+            exceeded.append(metric)
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump({
+                "commit": _commit(),
+                "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+                "python": platform.python_version(),
+                "platform": platform.platform(),
+                "cycles": args.cycles,
+                "warmup": args.warmup,
+                "failed_cycles": failures,
+                "slopes": {metric: {"slope": fitted, "limit": limit, "exceeded": over}
+                           for metric, (fitted, limit, over) in slopes.items()},
+                "top_growth": growth,
+                "samples": samples,
+            }, f, indent=2)
+            f.write("\n")
+
+    if failures:
+        print(f"{failures} of {args.cycles} cycles failed")
+    if exceeded:
+        sys.exit(f"Growth above the limit: {', '.join(exceeded)}")
+    if failures:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
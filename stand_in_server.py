@@ -0,0 +1,230 @@
+"""Local stand-in for the media server, for benchmarks and trying the shim without one
+
+Implements login, playback reporting, a paginated media library and a
+Range-capable stream endpoint, with configurable latency, bandwidth cap and
+error injection. Streams are synthetic bytes unless a media file is given.
+Run it directly to serve on localhost:8112 like the real server:
+
+    python stand_in_server.py --latency 0.02 --bandwidth 2000000 --error-rate 0.01
+"""
+import argparse
+import asyncio
+import os
+import random
+import secrets
+import time
+from typing import Dict, Optional, Set
+
+from aiohttp import web
+
+MEDIA_SIZE = 64 * 1024 * 1024  # Bytes of each synthetic stream
+WRITE_SIZE = 64 * 1024  # Bytes per write when streaming, the unit the bandwidth cap paces
+_PATTERN = bytes(range(256)) * (WRITE_SIZE // 256)
+
+
+class StandInServer:
+    """In-process media server on the running loop
+
+    latency is added before every response, bandwidth caps stream bodies in
+    bytes per second and error_rate is the share of API and stream requests
+    answered with a 503. All three can be changed while it runs.
+    """
+
+    def __init__(self, host: str = '127.0.0.1', port: int = 0, latency: float = 0,
+                 bandwidth: Optional[float] = None, error_rate: float = 0,
+                 media_path: Optional[str] = None, library_size: int = 1000,
+                 seed: Optional[int] = None):
+        self.host = host
+        self.port = port
+        self.latency = latency
+        self.bandwidth = bandwidth
+        self.error_rate = error_rate
+        self.media_path = media_path
+        self.library_size = library_size  # Media records, with ids 1 to library_size
+        self.tokens: Set[str] = set()
+        self.positions: Dict[int, float] = {}
+        self._created = time.time()
+        self._updated: Dict[int, float] = {}  # Media whose record changed after startup
+        self.requests: Dict[str, int] = {}  # Requests served per route name
+        self._random = random.Random(seed)
+        self._runner: Optional[web.AppRunner] = None
+
+    @property
+    def base_url(self) -> str:
+        return f"http://{self.host}:{self.port}"
+
+    async def start(self) -> None:
+        app = web.Application(middlewares=[self._inject_faults])
+        app.router.add_post('/api/auth/login', self._handle_login, name='login')
+        app.router.add_post('/api/media/playback', self._handle_report, name='report')
+        app.router.add_post('/api/media/playback/batch', self._handle_batch_report, name='batch_report')
+        app.router.add_get('/api/media/playback/{media_id}', self._handle_position, name='position')
+        app.router.add_get('/api/media', self._handle_library, name='library')
+        app.router.add_get(r'/api/media/{media_id:\d+}', self._handle_media, name='media')
+        app.router.add_get('/api/media/stream/{media_id}', self._handle_stream, name='stream')
+        self._runner = web.AppRunner(app, access_log=None)
+        await self._runner.setup()
+        await web.TCPSite(self._runner, self.host, self.port).start()
+        self.port = self._runner.addresses[0][1]
+
+    async def stop(self) -> None:
+        if self._runner:
+            await self._runner.cleanup()
+            self._runner = None
+
+    def revoke_tokens(self) -> None:
+        """Make every issued token invalid, as if they expired"""
+        self.tokens.clear()
+
+    @web.middleware
+    async def _inject_faults(self, request: web.Request, handler):
+        name = request.match_info.route.name or 'other'
+        self.requests[name] = self.requests.get(name, 0) + 1
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        if self.error_rate and self._random.random() < self.error_rate:
+            raise web.HTTPServiceUnavailable(text="Injected error")
+        return await handler(request)
+
+    def _check_token(self, request: web.Request) -> None:
+        token = request.headers.get('Authorization', '').removeprefix('Bearer ')
+        if token not in self.tokens:
+            raise web.HTTPUnauthorized()
+
+    async def _handle_login(self, request: web.Request) -> web.Response:
+        body = await request.json()
+        if not body.get('username') or not body.get('password'):
+            raise web.HTTPBadRequest(text="username and password are required")
+        token = secrets.token_hex(16)
+        self.tokens.add(token)
+        return web.json_response({'data': {'token': token}})
+
+    async def _handle_report(self, request: web.Request) -> web.Response:
+        self._check_token(request)
+        body = await request.json()
+        self._set_position(int(body['mediaId']), float(body['position']))
+        return web.json_response({'ok': True})
+
+    async def _handle_batch_report(self, request: web.Request) -> web.Response:
+        self._check_token(request)
+        for item in (await request.json())['items']:
+            self._set_position(int(item['mediaId']), float(item['position']))
+        return web.json_response({'ok': True})
+
+    def _set_position(self, media_id: int, position: float) -> None:
+        self.positions[media_id] = position
+        self._updated[media_id] = time.time()
+
+    async def _handle_position(self, request: web.Request) -> web.Response:
+        self._check_token(request)
+        position = self.positions.get(int(request.match_info['media_id']))
+        if position is None:
+            raise web.HTTPNotFound()
+        return web.json_response({'data': {'position': position}})
+
+    def _updated_at(self, media_id: int) -> float:
+        return self._updated.get(media_id, self._created)
+
+    def _record(self, media_id: int) -> dict:
+        record = {'id': media_id, 'title': f"Item {media_id}", 'duration': 1200 + media_id % 600,
+                  'updatedAt': self._updated_at(media_id)}
+        if media_id in self.positions:
+            record['position'] = self.positions[media_id]
+            record['lastWatched'] = self._updated[media_id]
+        return record
+
+    async def _handle_library(self, request: web.Request) -> web.Response:
+        self._check_token(request)
+        page = int(request.query.get('page', 1))
+        page_size = int(request.query.get('pageSize', 100))
+        media_ids = range(1, self.library_size + 1)
+        if 'changedSince' in request.query:
+            since = float(request.query['changedSince'])
+            media_ids = sorted((i for i in media_ids if self._updated_at(i) > since), key=self._updated_at)
+        items = [self._record(media_id) for media_id in media_ids[(page - 1) * page_size:page * page_size]]
+        return web.json_response({'data': {'items': items, 'total': self.library_size}})
+
+    async def _handle_media(self, request: web.Request) -> web.Response:
+        self._check_token(request)
+        media_id = int(request.match_info['media_id'])
+        if not 1 <= media_id <= self.library_size:
+            raise web.HTTPNotFound()
+        return web.json_response({'data': self._record(media_id)})
+
+    def _media_size(self) -> int:
+        return os.path.getsize(self.media_path) if self.media_path else MEDIA_SIZE
+
+    def _read(self, offset: int, length: int) -> bytes:
+        if self.media_path:
+            with open(self.media_path, 'rb') as f:
+                f.seek(offset)
+                return f.read(length)
+        start = offset % len(_PATTERN)
+        return (_PATTERN[start:] + _PATTERN[:start])[:length]
+
+    async def _handle_stream(self, request: web.Request) -> web.StreamResponse:
+        size = self._media_size()
+        start, end = 0, size - 1
+        status = 200
+        range_header = request.headers.get('Range', '')
+        if range_header.startswith('bytes='):
+            first, _, last = range_header[6:].partition('-')
+            if first:
+                start, end = int(first), int(last) if last else size - 1
+            else:
+                start = max(size - int(last), 0)
+            if start >= size:
+                raise web.HTTPRequestRangeNotSatisfiable(headers={'Content-Range': f"bytes */{size}"})
+            end = min(end, size - 1)
+            status = 206
+
+        response = web.StreamResponse(status=status, headers={
+            'Accept-Ranges': 'bytes',
+            'Content-Type': 'application/octet-stream',
+            'Content-Length': str(end - start + 1),
+        })
+        if status == 206:
+            response.headers['Content-Range'] = f"bytes {start}-{end}/{size}"
+        await response.prepare(request)
+        if request.method == 'HEAD':
+            return response
+
+        offset = start
+        while offset <= end:
+            data = self._read(offset, min(WRITE_SIZE, end - offset + 1))
+            await response.write(data)
+            offset += len(data)
+            if self.bandwidth:
+                await asyncio.sleep(len(data) / self.bandwidth)
+        await response.write_eof()
+        return response
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--host", default='localhost')
+    parser.add_argument("--port", type=int, default=8112)
+    parser.add_argument("--latency", type=float, default=0, help="seconds added to every response")
+    parser.add_argument("--bandwidth", type=float, help="stream bytes per second")
+    parser.add_argument("--error-rate", type=float, default=0, help="share of requests failing with 503")
+    parser.add_argument("--media", help="file to serve as every stream instead of synthetic bytes")
+    args = parser.parse_args()
+
+    async def serve():
+        server = StandInServer(args.host, args.port, args.latency, args.bandwidth,
+                               args.error_rate, args.media)
+        await server.start()
+        print(f"Stand-in server on {server.base_url}")
+        try:
+            await asyncio.Event().wait()
+        finally:
+            await server.stop()
+
+    try:
+        asyncio.run(serve())
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
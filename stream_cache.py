@@ -0,0 +1,349 @@
+import asyncio
+import hashlib
+import mmap
+import os
+import re
+from collections import OrderedDict
+from typing import Callable, Dict, Optional, Tuple
+
+import aiohttp
+from aiohttp import web
+
+CHUNK_SIZE = 1024 * 1024  # Bytes per cached chunk
+READAHEAD_CHUNKS = 8  # Chunks fetched ahead of the one being served
+MAX_UPSTREAM_FETCHES = 4  # Concurrent chunk downloads
+
+
+class ChunkCache:
+    """Size-bounded on-disk cache of fixed-size stream chunks with LRU eviction
+
+    Each key also has a ``<key>.size`` file with the stream's total size,
+    counted towards max_bytes and removed with the key's last chunk.
+    """
+
+    def __init__(self, directory: str, max_bytes: int, chunk_size: int = CHUNK_SIZE):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.chunk_size = chunk_size
+        self.total_bytes = 0
+        self.on_key_evicted: Optional[Callable[[str], None]] = None  # Called once a key's last chunk is gone
+        self._lru: "OrderedDict[str, int]" = OrderedDict()  # Chunk file name -> size
+        self._chunk_counts: Dict[str, int] = {}  # Key -> chunks indexed
+        self._size_files: Dict[str, int] = {}  # Key -> bytes of its .size file
+        os.makedirs(directory, exist_ok=True)
+        self._load_index()
+
+    def _load_index(self) -> None:
+        """Rebuild the LRU order from what is on disk, oldest first"""
+        entries = []
+        size_files = {}
+        for name in os.listdir(self.directory):
+            if name.endswith('.chunk'):
+                stat = os.stat(os.path.join(self.directory, name))
+                entries.append((stat.st_mtime, name, stat.st_size))
+            elif name.endswith('.size'):
+                size_files[name[:-len('.size')]] = os.path.getsize(os.path.join(self.directory, name))
+        for _, name, size in sorted(entries):
+            self._index(name, size)
+        for key, size in size_files.items():
+            if key in self._chunk_counts:
+                self._size_files[key] = size
+                self.total_bytes += size
+            else:
+                self._remove_file(f"{key}.size")  # Left behind by a key whose chunks are gone
+
+    @staticmethod
+    def _chunk_name(key: str, index: int) -> str:
+        return f"{key}-{index}.chunk"
+
+    @staticmethod
+    def _key_of(name: str) -> str:
+        return name[:-len('.chunk')].rsplit('-', 1)[0]
+
+    def _remove_file(self, name: str) -> bool:
+        try:
+            os.remove(os.path.join(self.directory, name))
+        except FileNotFoundError:
+            pass
+        except OSError:
+            return False
+        return True
+
+    def read_size(self, key: str) -> Optional[int]:
+        """Total size of a stream as stored by write_size, None if unknown"""
+        try:
+            with open(os.path.join(self.directory, f"{key}.size")) as f:
+                return int(f.read())
+        except (OSError, ValueError):
+            return None
+
+    def write_size(self, key: str, size: int) -> None:
+        """Store the total size of a stream and evict beyond max_bytes"""
+        text = str(size)
+        with open(os.path.join(self.directory, f"{key}.size"), 'w') as f:
+            f.write(text)
+        self.total_bytes += len(text) - self._size_files.get(key, 0)
+        self._size_files[key] = len(text)
+        self._evict()
+
+    def contains(self, key: str, index: int) -> bool:
+        return self._chunk_name(key, index) in self._lru
+
+    def read(self, key: str, index: int, start: int = 0, end: Optional[int] = None) -> Optional[bytes]:
+        """Return bytes [start, end) of a cached chunk through a memory map, or None on a miss"""
+        name = self._chunk_name(key, index)
+        if name not in self._lru:
+            return None
+        try:
+            with open(os.path.join(self.directory, name), 'rb') as f:
+                with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+                    data = mapped[start:end]
+        except (OSError, ValueError):
+            # File vanished or is empty, treat it as a miss
+            self._forget(name)
+            return None
+        self._lru.move_to_end(name)
+        return data
+
+    def write_file(self, key: str, index: int, data: bytes) -> None:
+        """Write a chunk to disk without touching the index, safe to run in an executor"""
+        path = os.path.join(self.directory, self._chunk_name(key, index))
+        temp_path = path + '.tmp'
+        with open(temp_path, 'wb') as f:
+            f.write(data)
+        os.replace(temp_path, path)
+
+    def add(self, key: str, index: int, size: int) -> None:
+        """Index a chunk written by write_file and evict beyond max_bytes"""
+        name = self._chunk_name(key, index)
+        if name in self._lru:
+            self.total_bytes -= self._lru.pop(name)
+            self._chunk_counts[key] -= 1
+        self._index(name, size)
+        self._evict()
+
+    def write(self, key: str, index: int, data: bytes) -> None:
+        """Store a chunk and evict least recently used chunks beyond max_bytes"""
+        self.write_file(key, index, data)
+        self.add(key, index, len(data))
+
+    def _evict(self) -> None:
+        for name in list(self._lru):
+            if self.total_bytes <= self.max_bytes:
+                break
+            if not self._remove_file(name):
+                continue  # Still open elsewhere, try again on the next write
+            self._forget(name)
+
+    def _index(self, name: str, size: int) -> None:
+        self._lru[name] = size
+        self.total_bytes += size
+        key = self._key_of(name)
+        self._chunk_counts[key] = self._chunk_counts.get(key, 0) + 1
+
+    def _forget(self, name: str) -> None:
+        size = self._lru.pop(name, None)
+        if size is None:
+            return
+        self.total_bytes -= size
+        key = self._key_of(name)
+        self._chunk_counts[key] -= 1
+        if self._chunk_counts[key]:
+            return
+        # Last chunk of the key, its size file and the proxy's state for it go too
+        del self._chunk_counts[key]
+        if key in self._size_files and self._remove_file(f"{key}.size"):
+            self.total_bytes -= self._size_files.pop(key)
+        if self.on_key_evicted:
+            self.on_key_evicted(key)
+
+
+class StreamCacheProxy:
+    """Local HTTP proxy that serves media streams from a ChunkCache
+
+    Runs on the caller's asyncio loop. mpv is pointed at url_for(stream_url);
+    Range requests are answered from cached chunks where possible and
+    missing chunks, plus READAHEAD_CHUNKS after them, are fetched upstream.
+    """
+
+    def __init__(self, session: aiohttp.ClientSession, cache: ChunkCache,
+                 host: str = '127.0.0.1', port: int = 0):
+        self.session = session
+        self.cache = cache
+        self.host = host
+        self.port = port
+        self._runner: Optional[web.AppRunner] = None
+        self._upstreams: Dict[str, str] = {}  # Cache key -> upstream URL
+        self._sizes: Dict[str, int] = {}
+        self._inflight: Dict[Tuple[str, int], asyncio.Future] = {}
+        # Key -> chunk index -> read-ahead fetch nobody waits for yet, cancelled once out of the window
+        self._read_aheads: Dict[str, Dict[int, asyncio.Future]] = {}
+        self._fetch_slots = asyncio.Semaphore(MAX_UPSTREAM_FETCHES)
+        cache.on_key_evicted = self._forget_key
+
+    async def start(self) -> None:
+        app = web.Application()
+        app.router.add_route('GET', '/stream/{key}', self._handle_stream)
+        app.router.add_route('HEAD', '/stream/{key}', self._handle_stream)
+        self._runner = web.AppRunner(app, access_log=None)
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, self.host, self.port)
+        await site.start()
+        # Pick up the port the OS assigned when port was 0
+        self.port = self._runner.addresses[0][1]
+
+    async def stop(self) -> None:
+        for future in self._inflight.values():
+            future.cancel()
+        if self._runner:
+            await self._runner.cleanup()
+            self._runner = None
+
+    def url_for(self, stream_url: str) -> str:
+        """Return the local URL mpv should open instead of stream_url"""
+        key = hashlib.sha1(stream_url.encode()).hexdigest()[:16]
+        self._upstreams[key] = stream_url
+        return f"http://{self.host}:{self.port}/stream/{key}"
+
+    async def prefetch(self, local_url: str) -> None:
+        """Fetch the first chunks of a stream before mpv opens local_url"""
+        key = local_url.rsplit('/', 1)[-1]
+        if key in self._upstreams:
+            self._read_ahead(key, -1, await self._get_size(key))
+
+    def _forget_key(self, key: str) -> None:
+        """Drop what is kept per stream once the cache evicted all of its chunks"""
+        self._upstreams.pop(key, None)
+        self._sizes.pop(key, None)
+        for future in self._read_aheads.pop(key, {}).values():
+            future.cancel()
+
+    async def _get_size(self, key: str) -> int:
+        size = self._sizes.get(key)
+        if size is None:
+            size = self.cache.read_size(key)
+            if size is None:
+                async with self.session.get(
+                    self._upstreams[key], headers={"Range": "bytes=0-0"}
+                ) as response:
+                    response.raise_for_status()
+                    content_range = response.headers.get("Content-Range", "")
+                    if '/' in content_range:
+                        size = int(content_range.rsplit('/', 1)[1])
+                    else:
+                        size = int(response.headers["Content-Length"])
+                self.cache.write_size(key, size)
+            self._sizes[key] = size
+        return size
+
+    def _want_chunk(self, key: str, index: int) -> asyncio.Future:
+        """Fetch a chunk someone waits for, a seek must no longer cancel it"""
+        self._read_aheads.get(key, {}).pop(index, None)
+        return self._start_fetch(key, index)
+
+    def _start_fetch(self, key: str, index: int) -> asyncio.Future:
+        """Fetch a chunk upstream, or return the fetch already running"""
+        future = self._inflight.get((key, index))
+        if future is None:
+            future = asyncio.ensure_future(self._fetch_chunk(key, index))
+            self._inflight[(key, index)] = future
+            future.add_done_callback(lambda f: self._fetch_done(key, index, f))
+        return future
+
+    def _fetch_done(self, key: str, index: int, future: asyncio.Future) -> None:
+        self._inflight.pop((key, index), None)
+        ahead = self._read_aheads.get(key)
+        if ahead and ahead.get(index) is future:
+            del ahead[index]
+        if not future.cancelled():
+            future.exception()  # Read-ahead failures are retried when the chunk is requested
+
+    async def _fetch_chunk(self, key: str, index: int) -> bytes:
+        upstream = self._upstreams[key]  # Looked up first, the key may be evicted while this waits
+        size = await self._get_size(key)
+        start = index * self.cache.chunk_size
+        end = min(start + self.cache.chunk_size, size) - 1
+        async with self._fetch_slots:
+            async with self.session.get(
+                upstream, headers={"Range": f"bytes={start}-{end}"}
+            ) as response:
+                if response.status != 206:
+                    raise aiohttp.ClientResponseError(
+                        response.request_info, response.history,
+                        status=response.status, message="Upstream ignored the Range request"
+                    )
+                data = await response.read()
+        # Once downloaded the chunk is stored even if the fetch is cancelled meanwhile
+        await asyncio.shield(self._store(key, index, data))
+        return data
+
+    async def _store(self, key: str, index: int, data: bytes) -> None:
+        await asyncio.get_running_loop().run_in_executor(
+            None, self.cache.write_file, key, index, data
+        )
+        self.cache.add(key, index, len(data))
+
+    def _read_ahead(self, key: str, index: int, size: int) -> None:
+        last = (size - 1) // self.cache.chunk_size
+        window = range(index + 1, min(index + 1 + READAHEAD_CHUNKS, last + 1))
+        ahead = self._read_aheads.setdefault(key, {})
+        # After a seek the old window's fetches would hold the slots the wanted chunk queues for
+        for stale in [i for i in ahead if i not in window]:
+            ahead.pop(stale).cancel()
+        for i in window:
+            if not self.cache.contains(key, i) and (key, i) not in self._inflight:
+                ahead[i] = self._start_fetch(key, i)
+
+    async def _handle_stream(self, request: web.Request) -> web.StreamResponse:
+        key = request.match_info['key']
+        if key not in self._upstreams:
+            raise web.HTTPNotFound()
+        try:
+            size = await self._get_size(key)
+        except aiohttp.ClientError as e:
+            print(f"Stream cache upstream failed: {e}")
+            raise web.HTTPBadGateway()
+
+        start, end = 0, size - 1
+        match = re.match(r'bytes=(\d*)-(\d*)', request.headers.get('Range', ''))
+        if match and (match.group(1) or match.group(2)):
+            if match.group(1):
+                start = int(match.group(1))
+                end = min(int(match.group(2)), size - 1) if match.group(2) else size - 1
+            else:
+                start = max(size - int(match.group(2)), 0)  # Suffix range
+            if start > end:
+                raise web.HTTPRequestRangeNotSatisfiable(headers={"Content-Range": f"bytes */{size}"})
+
+        response = web.StreamResponse(status=206 if match else 200)
+        response.headers["Accept-Ranges"] = "bytes"
+        response.content_length = end - start + 1
+        if match:
+            response.headers["Content-Range"] = f"bytes {start}-{end}/{size}"
+        await response.prepare(request)
+        if request.method == 'HEAD':
+            return response
+
+        chunk_size = self.cache.chunk_size
+        position = start
+        try:
+            while position <= end:
+                index = position // chunk_size
+                offset = position - index * chunk_size
+                length = min(chunk_size - offset, end - position + 1)
+                piece = self.cache.read(key, index, offset, offset + length)
+                if piece is None:
+                    # Queued before its read-ahead, fetch slots are handed out in order
+                    fetch = self._want_chunk(key, index)
+                    self._read_ahead(key, index, size)
+                    data = await asyncio.shield(fetch)
+                    piece = data[offset:offset + length]
+                else:
+                    self._read_ahead(key, index, size)
+                await response.write(piece)
+                position += len(piece)
+        except ConnectionResetError:
+            pass  # mpv dropped the connection, usually because it seeked
+        except aiohttp.ClientError as e:
+            print(f"Stream cache upstream failed: {e}")
+        return response
@@ -0,0 +1,584 @@
+import threading
+import asyncio
+import sys
+import os
+import time
+import re
+from async_player import AsyncPlayer
+from media_api_client import MediaAPIClient, create_session, stream_path
+from playback_reporter import PlaybackReporter
+from playback_journal import PlaybackJournal
+from property_sampler import PropertySampler
+from stream_cache import ChunkCache, StreamCacheProxy
+from offline_downloader import OfflineDownloader
+from play_scheduler import PlayScheduler
+from metrics import Metrics, MetricsServer
+from adaptive_buffer import BufferController
+from library_index import LibraryIndex, LibrarySync, is_finished
+from ipc_protocol import HAS_UNIX_SOCKETS, IPC_HOST, IPC_PORT, IPC_SOCKET_PATH, serve_connection
+from settings import (
+    USERNAME, PASSWORD, DEFAULT_MEDIA_ID, SERVER_URLS, PROTOCOL_HANDLER, SAMPLE_RATE, PLAY_DEBOUNCE, PREFLIGHT,
+    RESUME_PLAYBACK, PREFETCH_LEAD, ADAPTIVE_BUFFERING, ADAPTIVE_BITRATE_PARAM, STREAM_CACHE, STREAM_CACHE_DIR, STREAM_CACHE_SIZE, OFFLINE_DIR,
+    DOWNLOAD_CONNECTIONS, JOURNAL_PATH, JOURNAL_FSYNC, LIBRARY_INDEX_PATH, LIBRARY_SYNC_INTERVAL,
+    METRICS, METRICS_PORT, MPV_OPTIONS
+)
+import ctypes
+
+
+def _format_position(seconds):
+    minutes, seconds = divmod(int(seconds), 60)
+    hours, minutes = divmod(minutes, 60)
+    return f"{hours}:{minutes:02d}:{seconds:02d}" if hours else f"{minutes}:{seconds:02d}"
+
+
+class TrayApplication:
+    def __init__(self, initial_media_id=None):
+        self.icon = None
+        self.player = None
+        self._player_starting = None  # Task bringing up the player, shared by concurrent requests
+        self.client = None
+        self.loop = asyncio.new_event_loop()
+        self.running = True
+        self.ipc_servers = []
+        self._tasks = set()  # Keeps fire-and-forget tasks alive until they finish
+        self._ipc_commands = {
+            'play': self._ipc_play,
+            'enqueue': self._ipc_enqueue,
+            'stop': self._ipc_stop,
+            'next': self._ipc_next,
+            'seek': self._ipc_seek,
+            'pause': self._ipc_pause,
+            'status': self._ipc_status,
+            'stats': self._ipc_stats,
+            'shutdown': self._ipc_shutdown,
+        }
+        self.initial_media_id: int = initial_media_id
+        self.session = None  # aiohttp session
+        self.report_interval = 10  # Report every 10 seconds
+        self.reporter = None
+        self.sampler = None
+        self.stream_proxy = None
+        self.downloader = None
+        self._prefetched = None  # Player path of the queued item last prefetched
+        self.metrics = Metrics() if METRICS else None
+        self.metrics_server = None
+        self.buffer_controller = None
+        # Local, so the tray menu renders from it without waiting for the server
+        self.library = LibraryIndex(LIBRARY_INDEX_PATH)
+        self.library_sync = None
+        self._play_received = None  # When the play request waiting for its first frame arrived
+        self._stall_started = None
+        # Every play request goes through here so bursts cost one player transition
+        self.play_scheduler = PlayScheduler(self.async_play_video, PLAY_DEBOUNCE)
+
+    async def _async_init(self):
+        """Initialize async resources"""
+        # One tuned pool shared by API calls, reports and stream probes
+        self.session = create_session()
+        self.client = MediaAPIClient(SERVER_URLS, session=self.session, metrics=self.metrics)
+        await self.client.initialize()
+        self.reporter = PlaybackReporter(
+            self.client, self.report_interval, PlaybackJournal(JOURNAL_PATH, JOURNAL_FSYNC),
+            on_flush=self._on_positions_flushed
+        )
+        self.reporter.start()
+        self.sampler = PropertySampler(SAMPLE_RATE)
+        self.sampler.subscribe('time-pos', self._on_position_sample)
+        self.sampler.subscribe('pause', self._on_pause_sample)
+        if ADAPTIVE_BUFFERING:
+            self.buffer_controller = BufferController(self._apply_cache_limits, self._request_lower_bitrate)
+            self.sampler.subscribe('demuxer-cache-state', self._on_cache_state_sample)
+        if self.metrics:
+            await self._start_metrics()
+        self.sampler.start()
+        self.downloader = OfflineDownloader(self.client, OFFLINE_DIR, DOWNLOAD_CONNECTIONS)
+        if STREAM_CACHE:
+            self.stream_proxy = StreamCacheProxy(
+                self.session, ChunkCache(STREAM_CACHE_DIR, STREAM_CACHE_SIZE)
+            )
+            await self.stream_proxy.start()
+        
+        if not await self._ensure_logged_in():
+            sys.exit("Failed to login")
+
+        self.library_sync = LibrarySync(self.client, self.library, LIBRARY_SYNC_INTERVAL, self._refresh_menu)
+        self.library_sync.start()
+
+        # Play the item the instance was launched for, now that the client can resolve it
+        if self.initial_media_id is not None:
+            self.play_scheduler.request(stream_path(self.initial_media_id))
+
+    async def _start_metrics(self):
+        self.sampler.subscribe('paused-for-cache', self._on_cache_pause_sample)
+        self.metrics.gauge('report_queue_depth', lambda: len(self.reporter.pending))
+        self.metrics.gauge('demuxer_cache_seconds', lambda: (
+            self.player.properties['demuxer-cache-duration'].value if self.player else None
+        ))
+        if self.buffer_controller:
+            self.metrics.gauge('throughput_bytes_per_second', lambda: self.buffer_controller.throughput)
+        if METRICS_PORT:
+            self.metrics_server = MetricsServer(self.metrics, port=METRICS_PORT)
+            await self.metrics_server.start()
+
+    async def _ensure_logged_in(self):
+        # Lets the client renew an expired token on its own
+        self.client.set_credentials(USERNAME, PASSWORD)
+        if not self.client.token:
+            return await self.client.login(USERNAME, PASSWORD)
+        return True
+
+    async def _handle_ipc_client(self, reader, writer):
+        await serve_connection(reader, writer, self._dispatch_ipc)
+
+    async def _dispatch_ipc(self, cmd, args):
+        handler = self._ipc_commands.get(cmd)
+        if handler is None:
+            raise ValueError(f"Unknown command: {cmd}")
+        return await handler(**args)
+
+    def _spawn(self, coro):
+        """Run a coroutine in the background and log its failure"""
+        task = asyncio.ensure_future(coro)
+        self._tasks.add(task)
+
+        def done(task):
+            self._tasks.discard(task)
+            if not task.cancelled() and task.exception():
+                print(f"Background task failed: {task.exception()!r}")
+        task.add_done_callback(done)
+        return task
+
+    def _require_player(self):
+        if not self.player:
+            raise ValueError("Nothing is playing")
+        return self.player
+
+    async def _ipc_play(self, url=None, media_id=None):
+        # Acknowledge right away, the pre-flight and player switch run on their own
+        if self.metrics:
+            self.metrics.increment('ipc.play')
+            self._play_received = time.perf_counter()
+        self.play_scheduler.request(stream_path(media_id) if media_id is not None else url)
+        return {'accepted': True}
+
+    async def _ipc_enqueue(self, url=None, media_id=None):
+        if media_id is not None:
+            url = stream_path(media_id)
+        elif url is None:
+            raise ValueError("enqueue needs a url or a media_id")
+        self._spawn(self.play_scheduler.after_pending(self.async_enqueue_video, url))
+        return {'accepted': True}
+
+    async def _ipc_stop(self):
+        # Drops a pending play request too, then stops under the same transition lock
+        await self.play_scheduler.cancel()
+        await self.play_scheduler.after_pending(self._stop_player)
+
+    async def _ipc_next(self):
+        await self._require_player().next()
+
+    async def _ipc_seek(self, position, relative=False):
+        await self._require_player().seek(position, 'relative' if relative else 'absolute')
+
+    async def _ipc_pause(self, paused=None):
+        await self._require_player().set_pause(paused)
+
+    async def _ipc_status(self):
+        return self.player.status() if self.player else {'media_id': None}
+
+    async def _ipc_stats(self):
+        if not self.metrics:
+            raise ValueError("Metrics are disabled")
+        stats = self.metrics.snapshot()
+        if self.client.servers:
+            stats['servers'] = self.client.servers.status()
+        return stats
+
+    async def _ipc_shutdown(self):
+        self.running = False
+        self._spawn(self._shutdown())
+
+    async def _start_ipc_server(self):
+        try:
+            self.ipc_servers.append(await asyncio.start_server(
+                self._handle_ipc_client, IPC_HOST, IPC_PORT
+            ))
+            if HAS_UNIX_SOCKETS:
+                # Holding the TCP port means any existing socket file is stale
+                if os.path.exists(IPC_SOCKET_PATH):
+                    os.remove(IPC_SOCKET_PATH)
+                self.ipc_servers.append(await asyncio.start_unix_server(
+                    self._handle_ipc_client, IPC_SOCKET_PATH
+                ))
+            await asyncio.gather(*(server.serve_forever() for server in self.ipc_servers))
+        except asyncio.CancelledError:
+            print("IPC server stopped")
+
+    def _create_tray_icon(self):
+        from PIL import Image, ImageDraw
+
+        image = Image.new('RGB', (64, 64), 'white')
+        ImageDraw.Draw(image).rectangle((16, 16, 48, 48), fill='blue')
+        return image
+
+    def _on_play(self, icon, item):
+        self.loop.call_soon_threadsafe(self.play_scheduler.request)
+
+    def _on_download(self, icon, item):
+        asyncio.run_coroutine_threadsafe(self.async_download(), self.loop)
+
+    async def _cleanup(self):
+        print("Cleaning up resources...")
+
+        await self.play_scheduler.cancel()
+
+        if self.library_sync:
+            await self.library_sync.stop()
+        
+        for server in self.ipc_servers:
+            server.close()
+            await server.wait_closed()
+        if HAS_UNIX_SOCKETS and self.ipc_servers and os.path.exists(IPC_SOCKET_PATH):
+            os.remove(IPC_SOCKET_PATH)
+
+        if self._player_starting:
+            # Let a core that is still coming up finish, so it gets closed below
+            await asyncio.gather(self._player_starting, return_exceptions=True)
+        if self.player:
+            if self.sampler:
+                self.sampler.sample()
+            await self.player.stop()
+            await self.player.close()
+
+        if self.sampler:
+            await self.sampler.stop()
+
+        if self.stream_proxy:
+            await self.stream_proxy.stop()
+
+        if self.metrics_server:
+            await self.metrics_server.stop()
+
+        if self.downloader:
+            await self.downloader.cancel_all()
+
+        if self.reporter:
+            await self.reporter.close()
+        self.library.close()
+
+        if self.client:
+            await self.client.close()
+
+        if self.session:
+            await self.session.close()
+
+    def _on_exit(self, icon, item):
+        self.running = False
+        asyncio.run_coroutine_threadsafe(self._shutdown(), self.loop)
+
+    async def _shutdown(self):
+        await self._cleanup()
+        self.loop.stop()
+        if self.icon:
+            self.icon.stop()
+
+    def _refresh_menu(self):
+        if self.icon:
+            self.icon.update_menu()
+
+    def _on_positions_flushed(self, positions):
+        async def store():
+            await self.loop.run_in_executor(None, self.library.record_positions, positions)
+            self._refresh_menu()
+        self._spawn(store())
+
+    def _library_items(self, entries):
+        """Menu items for (media_id, title, position) rows of the library index"""
+        import pystray
+
+        if not entries:
+            return [pystray.MenuItem('Nothing yet', None, enabled=False)]
+        return [
+            pystray.MenuItem(f"{title} ({_format_position(position)})", self._play_media_action(media_id))
+            for media_id, title, position in entries
+        ]
+
+    def _play_media_action(self, media_id):
+        def action(icon, item):
+            self.loop.call_soon_threadsafe(self._play_media, media_id)
+        return action
+
+    def _play_media(self, media_id):
+        self.play_scheduler.request(self.client.stream_url(media_id))
+
+    def _setup_tray(self):
+        # Imported here so the services also run headless where there is no tray, as in the soak test
+        import pystray
+
+        # Submenus are rebuilt from the local index on update_menu(), never from the network
+        menu = pystray.Menu(
+            pystray.MenuItem('Continue Watching', pystray.Menu(
+                lambda: self._library_items(self.library.continue_watching())
+            )),
+            pystray.MenuItem('Recent', pystray.Menu(
+                lambda: self._library_items(self.library.recent())
+            )),
+            pystray.Menu.SEPARATOR,
+            pystray.MenuItem('Play Default', self._on_play),
+            pystray.MenuItem('Download Default', self._on_download),
+            pystray.MenuItem('Exit', self._on_exit)
+        )
+        self.icon = pystray.Icon(
+            "media_tray",
+            icon=self._create_tray_icon(),
+            menu=menu
+        )
+
+    def _register_protocol_handler(self):
+        try:
+            import winreg
+
+            exe_path = os.path.abspath(sys.argv[0]) # The script or packaged exe path
+
+            # --- MODIFICATION START ---
+
+            # Determine the path for pythonw.exe based on sys.executable
+            python_dir = os.path.dirname(sys.executable)
+            pythonw_path = os.path.join(python_dir, 'pythonw.exe')
+
+            # Check if pythonw.exe exists; fall back to sys.executable if not
+            # (This is defensive, it should normally exist alongside python.exe)
+            if not os.path.exists(pythonw_path):
+                print(f"Warning: pythonw.exe not found at {pythonw_path}, using {sys.executable}")
+                effective_python_executable = sys.executable
+            else:
+                effective_python_executable = pythonw_path
+
+            # Build the command string
+            if exe_path.endswith('.py'):
+                # If running as a script, use the pythonw.exe (or fallback) path
+                cmd = f'"{effective_python_executable}" "{exe_path}" "%1"'
+            else:
+                # If running as a packaged .exe, assume it's built correctly
+                # (e.g., as a windowed app) and just use its path.
+                cmd = f'"{exe_path}" "%1"'
+
+            # --- MODIFICATION END ---
+
+            # Optional: Print the command being registered for debugging
+            print(f"Attempting to register command: {cmd}")
+
+            # Proceed with registry writing as before
+            with winreg.CreateKey(winreg.HKEY_CURRENT_USER, f"Software\\Classes\\{PROTOCOL_HANDLER}") as key:
+                winreg.SetValue(key, "", winreg.REG_SZ, f"URL:{PROTOCOL_HANDLER} Protocol")
+                winreg.SetValueEx(key, "URL Protocol", 0, winreg.REG_SZ, "")
+
+                with winreg.CreateKey(key, r"shell\open\command") as cmd_key:
+                    # Write the correctly determined command string
+                    winreg.SetValue(cmd_key, "", winreg.REG_SZ, cmd)
+
+            print("Protocol registration check/update successful.") # Optional success message
+
+        except Exception as e:
+            # Print more details on failure
+            import traceback
+            print(f"Protocol registration failed: {e}")
+            # traceback.print_exc() # Uncomment for full stack trace during debuggin
+
+    def start_services(self):
+        """Start the loop thread with the API client, player services and IPC server, returns the init future"""
+        threading.Thread(
+            target=self.loop.run_forever,
+            daemon=True
+        ).start()
+
+        initialized = asyncio.run_coroutine_threadsafe(self._async_init(), self.loop)
+        asyncio.run_coroutine_threadsafe(self._start_ipc_server(), self.loop)
+        return initialized
+
+    def run(self):
+        self._register_protocol_handler()
+        self.start_services()
+
+        # Start tray
+        self._setup_tray()
+        threading.Thread(target=self.icon.run, daemon=True).start()
+
+        # Keep main thread responsive
+        try:
+            while self.running:
+                time.sleep(0.5)
+        except KeyboardInterrupt:
+            self._on_exit(None, None)
+
+    def _on_position_sample(self, position):
+        if position is not None and self.player:
+            self.reporter.update(self.player.media_id, position)
+            self._prefetch_next(position)
+
+    def _prefetch_next(self, position):
+        """Warm the proxy cache for the next queued item shortly before the current one ends"""
+        upcoming = self.player.upcoming
+        duration = self.player.properties['duration'].value
+        if not (self.stream_proxy and upcoming and duration) or duration - position > PREFETCH_LEAD:
+            return
+        path = upcoming[0][0]
+        if path != self._prefetched:
+            self._prefetched = path
+            self._spawn(self.stream_proxy.prefetch(path))
+
+    def _on_pause_sample(self, paused):
+        if paused:
+            self.reporter.request_flush()
+
+    def _on_cache_pause_sample(self, buffering):
+        """Count stalls and their duration, to the resolution of the sample rate"""
+        now = time.perf_counter()
+        if buffering and self._stall_started is None:
+            self._stall_started = now
+            self.metrics.increment('stalls')
+        elif not buffering and self._stall_started is not None:
+            self.metrics.observe('stall_seconds', now - self._stall_started)
+            self._stall_started = None
+
+    def _on_cache_state_sample(self, cache_state):
+        if self.player:
+            self.buffer_controller.update(self.player.media_id, cache_state, self.player.bitrate)
+
+    def _apply_cache_limits(self, cache_secs, max_bytes, readahead_secs):
+        print(f"Cache set to {cache_secs}s / {max_bytes // (1024 * 1024)} MiB, readahead {readahead_secs}s")
+        self._spawn(self.player.set_cache_limits(cache_secs, max_bytes, readahead_secs))
+
+    def _request_lower_bitrate(self, max_bitrate):
+        """Reopen the current item as a variant the link can sustain, at the current position"""
+        media_id = self.player.media_id
+        if media_id is None or self.downloader.local_path(media_id):
+            return
+        print(f"Throughput below the stream bitrate, asking for media {media_id} at {max_bitrate} bit/s")
+        stream_url = f"{self.client.stream_url(media_id)}?{ADAPTIVE_BITRATE_PARAM}={max_bitrate}"
+        self._spawn(self.player.reload(self._player_url(stream_url), start=self.player.last_position))
+
+    def _on_playback_start(self):
+        """Runs on the loop once the player shows the first frame of a file"""
+        if self._play_received is not None:
+            self.metrics.observe('time_to_first_frame', time.perf_counter() - self._play_received)
+            self._play_received = None
+
+    def _media_id_for(self, url):
+        """Extract the media_id from a stream URL"""
+        match = re.search(r'/stream/(\d+)', url)
+        return int(match.group(1)) if match else None
+
+    async def async_download(self, url=None):
+        media_id = self._media_id_for(url) if url else DEFAULT_MEDIA_ID
+        if media_id is not None:
+            await self.downloader.download(media_id)
+
+    async def _preflight(self, stream_url, media_id):
+        """Return whether the stream can be handed to the player"""
+        # A complete offline copy needs no pre-flight, the player picks it up itself
+        if PREFLIGHT and not self.downloader.local_path(media_id):
+            status = await self.client.probe_stream(stream_url)
+            if status != 200:
+                print(f"Stream unavailable: HTTP {status}")
+                return False
+        return True
+
+    async def _resume_position(self, media_id):
+        """Position to start an item at, preferring one not yet reported over the server's"""
+        if not RESUME_PLAYBACK or media_id is None:
+            return None
+        if self.player and self.player.media_id == media_id:
+            self.sampler.sample()
+        position = self.reporter.pending.get(media_id)
+        if position is None and self.client.token:
+            position = await self.client.get_playback_position(media_id)
+        if not position:
+            return None
+
+        # An item watched to the end starts over instead of reopening on its last seconds
+        if self.player and self.player.media_id == media_id:
+            duration = self.player.properties['duration'].value
+        else:
+            duration = await self.loop.run_in_executor(None, self.library.duration, media_id)
+        return None if is_finished(position, duration) else position
+
+    async def _ensure_player(self):
+        if self.player:
+            self.sampler.sample()  # Pick up the final position before switching
+            return self.player
+
+        # Shielded, a superseded play request must not drop a core that is still being built
+        if self._player_starting is None:
+            self._player_starting = asyncio.ensure_future(self._start_player())
+        return await asyncio.shield(self._player_starting)
+
+    async def _start_player(self):
+        # One warm player is reused for every item, driven from the loop without blocking it
+        try:
+            player = await AsyncPlayer.create(**MPV_OPTIONS)
+        finally:
+            self._player_starting = None
+        video = player.video
+        
+        # Positions are sampled from the player and coalesced by the reporter
+        self.sampler.attach(video.properties)
+        video.set_flush_callback(
+            lambda: self.loop.call_soon_threadsafe(self.reporter.request_flush)
+        )
+        video.set_local_source(self.downloader.local_path)
+        if self.metrics:
+            video.set_playback_start_callback(
+                lambda: self.loop.call_soon_threadsafe(self._on_playback_start)
+            )
+        self.player = player
+        return player
+
+    async def _stop_player(self):
+        if self.player:
+            self.sampler.sample()  # Pick up the final position before stopping
+            await self.player.stop()
+
+    def _player_url(self, stream_url):
+        return self.stream_proxy.url_for(stream_url) if self.stream_proxy else stream_url
+
+    async def _prepare(self, url):
+        """Return the stream URL on the preferred server, media_id and start position, or None"""
+        stream_url = self.client.route(url)
+        media_id = self._media_id_for(stream_url)
+
+        # The saved position is fetched alongside the pre-flight, so resuming costs no extra round-trip
+        available, start = await asyncio.gather(
+            self._preflight(stream_url, media_id),
+            self._resume_position(media_id)
+        )
+        return (stream_url, media_id, start) if available else None
+
+    async def async_play_video(self, url=None):
+        try:
+            prepared = await self._prepare(url or stream_path(DEFAULT_MEDIA_ID))
+            if not prepared:
+                self._play_received = None  # No first frame is coming for this request
+                return
+            stream_url, media_id, start = prepared
+            player = await self._ensure_player()
+            await player.play(self._player_url(stream_url), media_id, start=start)
+        except Exception:
+            # Neither is there after a failed start. A cancel leaves the newer request's time alone
+            self._play_received = None
+            raise
+
+    async def async_enqueue_video(self, url):
+        """Queue a stream after the current item, or play it if nothing is playing
+
+        The pre-flight runs now, so mpv can open the item ahead of time and move
+        on to it without another check or a player rebuild.
+        """
+        if not self.player:
+            await self.async_play_video(url)
+            return
+
+        prepared = await self._prepare(url)
+        if prepared:
+            stream_url, media_id, start = prepared
+            await self.player.play(self._player_url(stream_url), media_id, mode='append-play', start=start)
@@ -1,81 +1,265 @@
-import threading
 import os
 import sys
+import re
+import threading
+from collections import deque
 script_dir = os.path.dirname(__file__)
 os.environ["PATH"] = script_dir + os.pathsep + os.environ["PATH"]
 import mpv
+from property_sampler import LatestValue
+
+# Properties published to the asyncio side through LatestValue slots
+OBSERVED_PROPERTIES = (
+    'time-pos', 'duration', 'file-size', 'pause', 'paused-for-cache',
+    'demuxer-cache-duration', 'demuxer-cache-state'
+)
+# Events handed to the event listener, e.g. for AsyncPlayer
+FORWARDED_EVENTS = ('start-file', 'file-loaded', 'playback-restart', 'end-file', 'shutdown')
+
+
+def _media_id_from_path(path):
+    match = re.search(r'/stream/(\d+)', path or '')
+    return int(match.group(1)) if match else None
+
 
 class VideoPlayer:
-    def __init__(self):
-        self.player = mpv.MPV(
+    """Long-lived mpv player that switches media with loadfile instead of being rebuilt"""
+
+    def __init__(self, **mpv_options):
+        self.mpv_options = mpv_options
+        self.player = None
+        self.media_id = None
+        self.flush_callback = None
+        self.playback_start_callback = None
+        self.local_source = None
+        self.event_listener = None
+        self.properties = {name: LatestValue() for name in OBSERVED_PROPERTIES}
+        self._seeking = False
+        self._loading = False  # Between start-file and the first frame of that file
+        self._upcoming = deque()  # (path, media_id) of each loadfile not yet started
+        self._sources = {}  # Player path -> media_id of every entry loaded since the last replace
+        # Guards _upcoming and _sources, changed from the loop and read on mpv's event thread
+        self._queue_lock = threading.Lock()
+        self._create_core()
+
+    def _create_core(self):
+        options = dict(
             input_default_bindings=True,
             input_vo_keyboard=True,
-            osc=True
+            osc=True,
+            force_window='yes',
+            ontop='yes',
+            window_minimized='no',
+            idle='yes',  # Keep the core and its window alive between items
+            prefetch_playlist='yes',  # Open the next playlist entry before the current one ends
+            gapless_audio='yes'
         )
-        self.playback_thread = None
-        self._stop_event = threading.Event()
-        self.media_id = None
-        self.last_position = 0
-        self.position_callback = None
-
-        self.player['force-window'] = 'yes'
-        self.player['ontop'] = 'yes'         
-        self.player['window-minimized'] = 'no'
+        options.update(self.mpv_options)
+        self.player = mpv.MPV(**options)
         
-        # Set up a property observer to track playback position
-        self.player.observe_property("time-pos", self._on_time_change)
+        # Observers only store the newest value, consumers sample the slots
+        for name in OBSERVED_PROPERTIES:
+            self.player.observe_property(name, self._on_property_change)
+        self.player.event_callback('start-file')(self._on_start_file)
+        self.player.event_callback('seek')(self._on_seek)
+        self.player.event_callback('playback-restart')(self._on_playback_restart)
+        self.player.event_callback(*FORWARDED_EVENTS)(self._forward_event)
     
-    def _on_time_change(self, name, value):
-        """Called when playback position changes"""
-        if value is not None:
-            self.last_position = value
-            if self.position_callback:
-                self.position_callback(self.media_id, value)
-
-    def play_video(self, path: str, media_id: int = None):
-        # Stop any existing playback
-        self.stop()
-        
+    def _on_property_change(self, name, value):
+        """Called on mpv's event thread, must stay cheap"""
+        self.properties[name].set(value)
+
+    def _forward_event(self, event):
+        # The event struct is only valid during the callback, listeners get a copy
+        if self.event_listener:
+            self.event_listener(event.as_dict(decoder=mpv.lazy_decoder))
+
+    def restart_core(self):
+        """Replace a core that crashed or whose window was closed"""
+        print("MPV core was shut down, starting a new one")
+        self.player.terminate()
+        self._create_core()
+
+    @property
+    def last_position(self):
+        return self.properties['time-pos'].value or 0
+
+    @property
+    def bitrate(self):
+        """Average bitrate of the current file in bytes per second, None until known"""
+        size, duration = self.properties['file-size'].value, self.properties['duration'].value
+        return size / duration if size and duration else None
+
+    def _on_start_file(self, event):
+        """Called when mpv begins loading a playlist entry, ours or one picked with mpv's own bindings"""
+        if self.media_id is not None:
+            # Another item took over, report where the previous one ended
+            self._request_flush()
+        # Identify the entry that actually starts, the queue order says nothing after a skip back
+        path = self._entry_path(event.data.playlist_entry_id)
+        with self._queue_lock:
+            self.media_id = self._sources.get(path, _media_id_from_path(path))
+            for index, (queued, _) in enumerate(self._upcoming):
+                if queued == path:
+                    del self._upcoming[index]
+                    break
+        self._loading = True
+        self.properties['time-pos'].set(None)
+        self.properties['duration'].set(None)
+        self.properties['file-size'].set(None)
+
+    def _entry_path(self, entry_id):
+        """Path of a playlist entry by its id, the current entry on mpv versions without ids"""
+        playlist = self.player.playlist
+        for entry in playlist:
+            if entry.get('id') == entry_id:
+                return entry.get('filename')
+        for entry in playlist:
+            if entry.get('current'):
+                return entry.get('filename')
+        return None
+
+    @property
+    def upcoming(self):
+        """(path, media_id) of the queued items after the current one"""
+        with self._queue_lock:
+            return list(self._upcoming)
+
+    def _on_seek(self, event):
+        self._seeking = True
+
+    def _on_playback_restart(self, event):
+        """Called once playback resumes, e.g. after a seek completed"""
+        if self._loading:
+            self._loading = False
+            if self.playback_start_callback:
+                self.playback_start_callback()
+        if self._seeking:
+            self._seeking = False
+            self._request_flush()
+
+    def _request_flush(self):
+        if self.flush_callback:
+            self.flush_callback()
+
+    def play_video(self, path: str, media_id: int = None, mode: str = 'replace', start: float = None):
+        """Load a file into the running core, 'replace' switches now and 'append-play' queues it
+
+        With start the file is opened directly at that offset rather than seeked after loading.
+        """
+        if self.player.core_shutdown:
+            # Core crashed or its window was closed, only now start a fresh one
+            self.restart_core()
+            mode = 'replace'
+        self.player.command(*self.load_command(path, media_id, mode, start))
+
+    def load_command(self, path: str, media_id: int = None, mode: str = 'replace', start: float = None):
+        """Record a loadfile in the queue bookkeeping and return the mpv command for it"""
         # Extract media_id from URL if not provided
-        if media_id is None and '/stream/' in path:
-            import re
-            match = re.search(r'/stream/(\d+)', path)
-            if match:
-                media_id = int(match.group(1))
-        
-        self.media_id = media_id
-        self.last_position = 0
-        
-        # Start new playback in a thread
-        self.playback_thread = threading.Thread(
-            target=self._play,
-            args=(path,),
-            daemon=True
-        )
-        self.playback_thread.start()
+        if media_id is None:
+            media_id = _media_id_from_path(path)
+
+        # Prefer a complete offline copy over the network stream
+        local_path = self.local_source(media_id) if self.local_source and media_id is not None else None
+        if local_path:
+            path = local_path
+
+        if mode == 'replace':
+            self.clear_queue()
+        with self._queue_lock:
+            self._upcoming.append((path, media_id))
+            self._sources[path] = media_id
+        return self._loadfile(path, mode, start)
+
+    def _loadfile(self, path: str, mode: str, start: float = None):
+        options = f"start={start:.3f}" if start else ''
+        if self.player.mpv_version_tuple >= (0, 38, 0):
+            return ('loadfile', path, mode, -1, options)
+        return ('loadfile', path, mode, options)
         
-    def set_position_callback(self, callback):
-        """Set a callback function to receive position updates"""
-        self.position_callback = callback
-
-    def _play(self, path: str):
-        try:
-            self.player.play(path)
-            while not self._stop_event.is_set() and self.player.core_idle:
-                self.player.wait_for_playback()
-        except mpv.ShutdownError as e:
-            print(f"MPV shutdown handled: {e}")
-        finally:
-            self._cleanup()
+    def set_flush_callback(self, callback):
+        """Set a callback invoked when pending positions should be reported now (seek, stop)"""
+        self.flush_callback = callback
+
+    def set_playback_start_callback(self, callback):
+        """Set a callback invoked on mpv's event thread when a file shows its first frame"""
+        self.playback_start_callback = callback
+
+    def set_event_listener(self, callback):
+        """Set a callback receiving FORWARDED_EVENTS as dicts on mpv's event thread"""
+        self.event_listener = callback
+
+    def set_local_source(self, callback):
+        """Set a callback mapping a media_id to a local file, or None if there is none"""
+        self.local_source = callback
 
     def stop(self):
-        if self.playback_thread and self.playback_thread.is_alive():
-            self._stop_event.set()
-            self.player.terminate()
-            self.playback_thread.join(timeout=1)
-            self._cleanup()
-
-    def _cleanup(self):
-        self._stop_event.clear()
+        """Stop playback but keep the core warm for the next item"""
+        self.clear_queue()
+        if not self.player.core_shutdown:
+            self.player.stop()
+
+    def clear_queue(self):
+        """Report the current position and forget the queued items"""
+        self._request_flush()
+        with self._queue_lock:
+            self._upcoming.clear()
+            self._sources.clear()
+
+    def reload(self, path: str, start: float = None):
+        """Reopen the current item from another source, e.g. a lower-bitrate variant, keeping the queue"""
+        for command in self.reload_commands(path, start):
+            self.player.command(*command)
+
+    def reload_commands(self, path: str, start: float = None):
+        """Record a reload in the queue bookkeeping and return the mpv commands for it, to run in order
+
+        The new source goes in right after the current entry and playback skips
+        to it at once, the queued items stay behind it.
+        """
+        with self._queue_lock:
+            self._upcoming.appendleft((path, self.media_id))
+            self._sources[path] = self.media_id
+        if self.player.mpv_version_tuple >= (0, 38, 0):
+            return [self._loadfile(path, 'insert-next', start), ('playlist-next', 'weak')]
+        # No insert-next before 0.38, append and move the entry behind the current one
+        count, position = self.player.playlist_count, self.player.playlist_pos
+        return [
+            self._loadfile(path, 'append', start),
+            ('playlist-move', count, position + 1),
+            ('playlist-next', 'weak'),
+        ]
+
+    def set_cache_limits(self, cache_secs: float, max_bytes: int, readahead_secs: float):
+        """Resize the demuxer cache of the running core"""
+        self.player['cache-secs'] = cache_secs
+        self.player['demuxer-max-bytes'] = max_bytes
+        self.player['demuxer-readahead-secs'] = readahead_secs
+
+    def next(self):
+        """Skip to the next queued item"""
+        if self._upcoming:
+            self.player.playlist_next()
+
+    def seek(self, seconds: float, reference: str = 'absolute'):
+        """Seek to a position, or by an offset with reference='relative'"""
+        self.player.seek(seconds, reference=reference)
+
+    def set_pause(self, paused: bool = None):
+        """Pause or resume playback, toggling when paused is None"""
+        self.player.pause = (not self.player.pause) if paused is None else paused
+
+    def status(self) -> dict:
+        """Snapshot of the playback state from the sampled properties"""
+        return {
+            'media_id': self.media_id,
+            'position': self.properties['time-pos'].value,
+            'paused': bool(self.properties['pause'].value),
+            'buffering': bool(self.properties['paused-for-cache'].value),
+            'queue': [media_id for _, media_id in self.upcoming],
+        }
+
+    def close(self):
+        """Shut the core down for good"""
         if self.player:
-            self.player.terminate()
+            self.player.terminate()
\ No newline at end of file